@@ -0,0 +1,138 @@
+"""
+Scan throughput benchmark: images/sec vs number of worker processes.
+
+Generates a synthetic JPEG corpus once, then scans it from scratch with each
+worker count (1 = in-process threaded pipeline, N > 1 = N worker processes).
+
+Only scan_directory is timed. Pool startup and model loading are measured by
+scanning an empty folder with the same settings and reported separately, so
+multi-process runs are not charged for spawning their workers. Images contain
+insightface's bundled group photo when it is available, so both detection and
+recognition run; otherwise they hold no faces and only detection is measured.
+
+    python benchmark_scan.py --images 300 --workers 1,2,4,8 [--gpu]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import logging
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from scanner import Scanner
+
+logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+
+
+def load_face_fixture():
+    """insightface's sample group photo (BGR), or None when it is not available."""
+    try:
+        from insightface.data import get_image
+        return get_image("t1")
+    except Exception as e:
+        logging.warning(f"Face fixture not available ({e}); the corpus will contain no faces")
+        return None
+
+
+def make_corpus(folder: str, count: int, width: int, height: int, fixture=None):
+    """
+    Writes `count` random JPEGs with some drawn shapes so decoding is realistic, each
+    with the face fixture pasted in at a random scale and position when given.
+    """
+    rng = np.random.default_rng(0)
+    os.makedirs(folder, exist_ok=True)
+    for i in range(count):
+        img = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+        img = cv2.GaussianBlur(img, (0, 0), 3)
+        for _ in range(5):
+            center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+            color = tuple(int(c) for c in rng.integers(0, 255, 3))
+            cv2.circle(img, center, int(rng.integers(20, height // 4)), color, -1)
+        if fixture is not None:
+            scale = min(width / fixture.shape[1], height / fixture.shape[0]) * rng.uniform(0.6, 1.0)
+            faces = cv2.resize(fixture, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            y = int(rng.integers(0, height - faces.shape[0] + 1))
+            x = int(rng.integers(0, width - faces.shape[1] + 1))
+            img[y:y + faces.shape[0], x:x + faces.shape[1]] = faces
+        cv2.imwrite(os.path.join(folder, f"img_{i:05d}.jpg"), img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+
+
+def run_once(corpus: str, workers: int, use_gpu: bool) -> tuple:
+    """Scans the corpus into a fresh index. Returns (elapsed seconds, faces found)."""
+    index_dir = os.path.join(corpus, ".faceframe")
+    shutil.rmtree(index_dir, ignore_errors=True)
+    thumbnail_dir = os.path.join(index_dir, "thumbnails")
+    os.makedirs(thumbnail_dir)
+    processor_options = {"use_gpu": use_gpu, "thumbnail_dir": thumbnail_dir}
+
+    if workers > 1:
+        scanner = Scanner(os.path.join(index_dir, "index.db"), None,
+                          processes=workers, processor_options=processor_options)
+    else:
+        from processor import FaceProcessor
+        scanner = Scanner(os.path.join(index_dir, "index.db"), FaceProcessor(**processor_options))
+
+    start = time.perf_counter()
+    report = scanner.scan_directory(corpus)
+    elapsed = time.perf_counter() - start
+    scanner.db.close()
+    return elapsed, report["faces"]
+
+
+def startup_time(workers: int, use_gpu: bool) -> float:
+    """
+    Seconds a scan of an empty folder takes: spawning the worker pool and loading
+    the models in every worker (N > 1), or nothing beyond a warm model cache (1).
+    """
+    empty = tempfile.mkdtemp(prefix="faceframe_bench_empty_")
+    try:
+        return run_once(empty, workers, use_gpu)[0]
+    finally:
+        shutil.rmtree(empty, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=200, help="synthetic images to generate")
+    parser.add_argument("--size", default="1600x1200", help="image size WIDTHxHEIGHT")
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated worker counts")
+    parser.add_argument("--gpu", action="store_true", help="use CUDAExecutionProvider")
+    parser.add_argument("--corpus", help="reuse/create the corpus in this folder")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    corpus = args.corpus or tempfile.mkdtemp(prefix="faceframe_bench_")
+    os.makedirs(corpus, exist_ok=True)
+    if not any(name.endswith(".jpg") for name in os.listdir(corpus) if os.path.isfile(os.path.join(corpus, name))):
+        print(f"Generating {args.images} images ({width}x{height}) in {corpus} ...")
+        make_corpus(corpus, args.images, width, height, load_face_fixture())
+    images = sum(1 for name in os.listdir(corpus) if name.endswith(".jpg"))
+
+    print(f"{'workers':>8} {'startup':>9} {'seconds':>10} {'images/sec':>12} {'speedup':>8} {'faces':>7}")
+    baseline = None
+    total_faces = 0
+    for workers in (int(w) for w in args.workers.split(",")):
+        startup = startup_time(workers, args.gpu)
+        elapsed, faces = run_once(corpus, workers, args.gpu)
+        # Workers start again for the timed scan; their startup is not scan throughput
+        elapsed = max(elapsed - startup, 1e-6) if workers > 1 else elapsed
+        total_faces += faces
+        rate = images / elapsed
+        baseline = baseline or rate
+        print(f"{workers:>8} {startup:>9.2f} {elapsed:>10.2f} {rate:>12.1f} {rate / baseline:>7.2f}x {faces:>7}",
+              flush=True)
+    if not total_faces:
+        print("No faces were found: only detection was measured, recognition never ran.")
+
+    if not args.corpus:
+        shutil.rmtree(corpus, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
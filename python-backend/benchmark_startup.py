@@ -0,0 +1,75 @@
+"""
+Backend startup benchmark.
+
+Measures how long `main.py` takes from process start until it answers PING,
+then reports the import time of each backend module (each imported alone in a
+fresh interpreter, so shared dependencies such as numpy are counted every time).
+
+    python benchmark_startup.py [--runs 5] [--modules main,processor]
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+MAIN = os.path.join(BACKEND_DIR, "main.py")
+
+MODULES = ("main", "providers", "session", "database", "vector_store", "scanner",
+           "similarity", "clusterer", "faiss_clustering", "processor")
+
+
+def time_to_pong() -> float:
+    """Starts the backend, sends PING and returns seconds until the pong line arrives."""
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, MAIN], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, text=True, cwd=BACKEND_DIR)
+    try:
+        proc.stdin.write(json.dumps({"action": "PING"}) + "\n")
+        proc.stdin.flush()
+        for line in proc.stdout:
+            if json.loads(line).get("status") == "pong":
+                return time.perf_counter() - start
+        raise RuntimeError("backend exited without answering PING")
+    finally:
+        proc.stdin.close()
+        proc.wait()
+
+
+def import_time(module: str) -> float:
+    """Cumulative import time of a module in seconds, from python -X importtime."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, cwd=BACKEND_DIR)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    for line in reversed(result.stderr.splitlines()):
+        # "import time: self [us] | cumulative | imported package"
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1]) / 1e6
+    raise RuntimeError("module not found in -X importtime output")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="backend starts to time")
+    parser.add_argument("--modules", default=",".join(MODULES), help="comma-separated modules to report")
+    args = parser.parse_args()
+
+    times = sorted(time_to_pong() for _ in range(args.runs))
+    print(f"time to first PONG over {args.runs} runs: "
+          f"min {times[0] * 1000:.0f} ms, median {times[len(times) // 2] * 1000:.0f} ms, "
+          f"max {times[-1] * 1000:.0f} ms")
+
+    print(f"\n{'module':<18} {'import ms':>10}")
+    for module in args.modules.split(","):
+        try:
+            print(f"{module:<18} {import_time(module) * 1000:>10.1f}", flush=True)
+        except RuntimeError as e:
+            print(f"{module:<18} {'failed':>10}  ({e})", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,98 +1,190 @@
 import numpy as np
 from sklearn.cluster import DBSCAN
 import logging
-import json
 from database import Database
+from embeddings import normalize_rows
+from vector_store import VectorStore
+import faiss_clustering
 
 logger = logging.getLogger("FaceFrameClusterer")
 
+# Incremental mode: minimum cosine similarity between a face and a person's
+# (normalized) centroid for the face to join that person
+ASSIGN_SIMILARITY = 0.6
+
+# Faces per block when matching against centroids (bounds the similarity matrix size)
+ASSIGN_CHUNK = 4096
+
+# DBSCAN parameters shared by both engines
+# eps=0.5 -> cosine similarity > ~0.87 for normalized vectors
+# min_samples=2 for small datasets (was 3)
+DBSCAN_EPS = 0.5
+DBSCAN_MIN_SAMPLES = 2
+
+# engine="auto" switches to FAISS from this many faces on
+FAISS_MIN_FACES = 20000
+ENGINES = ("auto", "dbscan", "faiss")
+
 class Clusterer:
-    def __init__(self, db_path: str):
-        self.db = Database(db_path)
+    def __init__(self, db_path: str, db: Database = None, vector_store: VectorStore = None):
+        self.db = db or Database(db_path)
+        self.vector_store = vector_store or VectorStore.for_database(db_path)
 
-    def run_clustering(self):
+    def run_clustering(self, incremental: bool = True, assign_similarity: float = ASSIGN_SIMILARITY,
+                       engine: str = "auto", progress_callback=None, abort_check=None):
+        """
+        Clusters unclustered faces and returns the number of new persons.
+
+        In incremental mode, faces are first matched to existing persons by nearest
+        centroid (cosine similarity >= assign_similarity), and only the residual
+        faces go through DBSCAN to form new persons.
+
+        engine: "dbscan" (scikit-learn), "faiss" (FaissDBSCAN on a FAISS index) or
+        "auto" (FAISS for FAISS_MIN_FACES faces or more, when installed).
+
+        progress_callback(phase, current, total) reports the phases "loading",
+        "assigning", "clustering" and "saving". abort_check() is polled between
+        steps; an aborted run writes nothing further and returns 0 (faces already
+        assigned to existing persons stay assigned).
+        """
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown clustering engine: {engine}")
         logger.info("Starting clustering...")
-        
-        # 1. Fetch unclustered faces
-        rows = self.db.get_unclustered_faces() # [(id, embedding_json), ...]
-        if not rows:
+        progress = progress_callback or (lambda phase, current, total: None)
+        aborted = abort_check or (lambda: False)
+
+        # 1. Fetch unclustered faces as one contiguous matrix
+        progress("loading", 0, None)
+        face_ids, X = self._load_unclustered()
+        if len(face_ids) == 0:
             logger.info("No unclustered faces found.")
             return 0
-            
-        face_ids = []
-        embeddings = []
-        
-        for r in rows:
-            face_ids.append(r[0])
-            # Embedding is stored as JSON string, parse it
-            try:
-                emb_data = r[1]
-                if isinstance(emb_data, str):
-                    emb = np.array(json.loads(emb_data), dtype=np.float32)
-                elif isinstance(emb_data, bytes):
-                    emb = np.array(json.loads(emb_data.decode('utf-8')), dtype=np.float32)
-                else:
-                    logger.warning(f"Unknown embedding type for face {r[0]}: {type(emb_data)}")
-                    continue
-                embeddings.append(emb)
-            except Exception as e:
-                logger.error(f"Failed to parse embedding for face {r[0]}: {e}")
-                continue
-            
-        if len(embeddings) < 2:
+
+        # Normalize embeddings for better clustering (InsightFace embeddings should already be normalized)
+        X = normalize_rows(X)
+
+        if incremental:
+            face_ids, X = self._assign_to_existing(face_ids, X, assign_similarity, progress, aborted)
+
+        if aborted():
+            logger.info("Clustering cancelled.")
+            return 0
+        if len(face_ids) < 2:
             logger.info("Not enough valid embeddings for clustering (need at least 2).")
             return 0
 
-        X = np.array(embeddings)
-        
-        # Normalize embeddings for better clustering (InsightFace embeddings should already be normalized)
-        norms = np.linalg.norm(X, axis=1, keepdims=True)
-        norms[norms == 0] = 1  # Prevent division by zero
-        X = X / norms
-        
         # 2. Run DBSCAN
-        # eps=0.5 -> cosine similarity > ~0.87 for normalized vectors
-        # min_samples=2 for small datasets (was 3)
-        clustering = DBSCAN(eps=0.5, min_samples=2, metric="euclidean", n_jobs=-1).fit(X)
-        labels = clustering.labels_
-        
+        progress("clustering", 0, len(face_ids))
+        labels = self._cluster(X, engine, progress, aborted)
+        if labels is None or aborted():
+            logger.info("Clustering cancelled.")
+            return 0
+
         # 3. Process results
         # labels: -1 = noise, 0..N = cluster ID
-        
-        cluster_map = {} # label_id -> db_person_id
-        
-        new_people_count = 0
-        assigned_count = 0
-        
-        unique_labels = set(labels)
-        
-        for label in unique_labels:
-            if label == -1:
-                continue
-                
-            # Create new person for this cluster
-            person_name = f"Person {label + 1}"
-            person_id = self.db.create_person(name=person_name)
-            cluster_map[label] = person_id
-            new_people_count += 1
-            
-            # Set first face as thumbnail for this person
-            first_face_idx = list(labels).index(label)
-            # TODO: Get thumbnail path from face and update person
-            
-        # 4. Update Faces
-        for idx, label in enumerate(labels):
-            if label != -1:
-                person_id = cluster_map[label]
-                face_id = face_ids[idx]
-                self.db.update_face_person(face_id, person_id)
-                assigned_count += 1
-        
-        # 5. Set thumbnail for each person from their first face
-        for label, person_id in cluster_map.items():
-            thumbnail = self.db.get_first_face_thumbnail(person_id)
-            if thumbnail:
-                self.db.update_person_thumbnail(person_id, thumbnail)
-                
+        clustered_idx = np.flatnonzero(labels != -1)
+        if len(clustered_idx) == 0:
+            logger.info("Clustering complete. No clusters found.")
+            return 0
+
+        clustered_labels = labels[clustered_idx]
+        # Sorted cluster labels and the first face (in id order) of each cluster
+        cluster_labels, first_pos = np.unique(clustered_labels, return_index=True)
+        first_face_ids = face_ids[clustered_idx[first_pos]]
+
+        # Centroid (mean normalized embedding) per new cluster
+        cluster_pos = np.searchsorted(cluster_labels, clustered_labels)
+        counts = np.bincount(cluster_pos, minlength=len(cluster_labels))
+        centroids = np.zeros((len(cluster_labels), X.shape[1]), dtype=np.float32)
+        np.add.at(centroids, cluster_pos, X[clustered_idx])
+        centroids /= counts[:, None]
+
+        # 4. Write everything back in one transaction
+        progress("saving", 0, len(clustered_idx))
+        with self.db.transaction():
+            person_ids = np.array(
+                self.db.create_persons(f"Person {label + 1}" for label in cluster_labels),
+                dtype=np.int64
+            )
+            self.db.assign_faces(face_ids[clustered_idx], person_ids[cluster_pos])
+            self.db.set_person_centroids(person_ids, centroids, counts)
+
+            # 5. Set thumbnail for each person from their first face
+            self.db.set_person_thumbnails_from_faces(person_ids, first_face_ids)
+
+        new_people_count = len(person_ids)
+        assigned_count = len(clustered_idx)
         logger.info(f"Clustering complete. Created {new_people_count} people. Assigned {assigned_count} faces.")
         return new_people_count
+
+    def _load_unclustered(self):
+        """Unclustered (face_ids, embeddings), read from the memory-mapped vector store when possible."""
+        try:
+            self.vector_store.sync(self.db)
+            face_ids = self.db.get_unclustered_face_ids()
+            X, found = self.vector_store.lookup(face_ids)
+            if found.all():
+                return face_ids, X
+            logger.warning(f"{int((~found).sum())} faces missing from the vector store; reading from database.")
+        except Exception as e:
+            logger.error(f"Vector store unavailable, reading embeddings from database: {e}")
+        return self.db.get_unclustered_embeddings()
+
+    def _cluster(self, X, engine: str, progress, aborted):
+        """Returns DBSCAN labels for X (-1 = noise) using the requested engine, or None if aborted."""
+        if engine == "auto":
+            engine = "faiss" if len(X) >= FAISS_MIN_FACES and faiss_clustering.is_available() else "dbscan"
+        elif engine == "faiss" and not faiss_clustering.is_available():
+            logger.warning("FAISS engine requested but faiss is not installed; using scikit-learn DBSCAN.")
+            engine = "dbscan"
+
+        logger.info(f"Clustering {len(X)} faces with {engine} engine.")
+        if engine == "faiss":
+            return faiss_clustering.FaissDBSCAN(eps=DBSCAN_EPS, min_samples=DBSCAN_MIN_SAMPLES).fit_predict(
+                X, progress_callback=lambda done, total: progress("clustering", done, total), abort_check=aborted)
+        return DBSCAN(eps=DBSCAN_EPS, min_samples=DBSCAN_MIN_SAMPLES, metric="euclidean", n_jobs=-1).fit(X).labels_
+
+    def _assign_to_existing(self, face_ids, X, assign_similarity: float, progress, aborted):
+        """
+        Assigns faces to the person with the most similar centroid, updating the
+        centroids as running means. Returns the (face_ids, X) left unassigned.
+        """
+        rebuilt = self.db.rebuild_missing_centroids()
+        if rebuilt:
+            logger.info(f"Computed centroids for {rebuilt} persons.")
+
+        person_ids, centroids, counts = self.db.get_person_centroids()
+        if len(person_ids) == 0:
+            return face_ids, X
+
+        # Nearest centroid per face, in blocks to bound memory
+        C = normalize_rows(centroids)
+        best = np.empty(len(face_ids), dtype=np.int64)
+        best_sim = np.empty(len(face_ids), dtype=np.float32)
+        for start in range(0, len(face_ids), ASSIGN_CHUNK):
+            if aborted():
+                return face_ids, X
+            progress("assigning", start, len(face_ids))
+            sims = X[start:start + ASSIGN_CHUNK] @ C.T
+            best[start:start + ASSIGN_CHUNK] = np.argmax(sims, axis=1)
+            best_sim[start:start + ASSIGN_CHUNK] = sims[np.arange(len(sims)), best[start:start + ASSIGN_CHUNK]]
+
+        hit = best_sim >= assign_similarity
+        if not hit.any():
+            return face_ids, X
+
+        # Running mean update for every person that gained faces
+        targets = best[hit]
+        added = np.bincount(targets, minlength=len(person_ids))
+        sums = centroids * counts[:, None]
+        np.add.at(sums, targets, X[hit])
+        changed = np.flatnonzero(added)
+        new_counts = counts[changed] + added[changed]
+        new_centroids = sums[changed] / new_counts[:, None]
+
+        with self.db.transaction():
+            self.db.assign_faces(face_ids[hit], person_ids[targets])
+            self.db.set_person_centroids(person_ids[changed], new_centroids, new_counts)
+
+        logger.info(f"Assigned {int(hit.sum())} faces to {len(changed)} existing people.")
+        return face_ids[~hit], X[~hit]
@@ -1,202 +1,856 @@
+import os
 import sqlite3
 import logging
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 import json
+from embeddings import encode_embedding, decode_embedding, decode_matrix, normalize_rows
+import numpy as np
 
 logger = logging.getLogger("FaceFrameDatabase")
 
+# Bump together with a new entry in Database._migrations()
+SCHEMA_VERSION = 12
+
+# files.hash_algo of files that could not be decoded as images; they are skipped
+# until their change key (size, mtime_ns, inode) changes
+FAILED_HASH_ALGO = ""
+
+# Connection tuning applied to every pooled connection
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=268435456",   # 256 MB
+    "PRAGMA cache_size=-65536",     # 64 MB (negative = KiB)
+    "PRAGMA temp_store=MEMORY",
+)
+
 class Database:
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, embedding_dtype: str = "float32"):
         self.db_path = db_path
+        # Storage precision for new embeddings ('float32' or 'float16')
+        self.embedding_dtype = embedding_dtype
+
+        # One long-lived connection per thread
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        # Read-only connection used only to watch for commits (see data_version)
+        self._watch_conn = None
+
         self._init_db()
 
     def _init_db(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Files table: Tracks scanned files to skip re-processing
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS files (
-                path TEXT PRIMARY KEY,
-                hash TEXT,
-                modified_time REAL,
-                scanned_at REAL
-            )
-        ''')
-
-        # Persons table: Clusters of faces
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS persons (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT,
-                thumbnail_path TEXT,
-                created_at REAL
-            )
-        ''')
-
-        # Faces table: Individual detections
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS faces (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                file_path TEXT,
-                embedding BLOB,
-                bbox TEXT,
-                thumbnail_path TEXT,
-                person_id INTEGER,
-                FOREIGN KEY(file_path) REFERENCES files(path),
-                FOREIGN KEY(person_id) REFERENCES persons(id)
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        """
+        Brings the schema up to SCHEMA_VERSION. The current version is kept in
+        PRAGMA user_version, so each migration runs once per index.db; older files
+        (user_version 0) are upgraded in place. Migrations are idempotent in case
+        two processes open an old database at the same time.
+        """
+        version = self.get_connection().execute("PRAGMA user_version").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            logger.warning(f"Database schema v{version} is newer than supported v{SCHEMA_VERSION}.")
+            return
+
+        for target, migrate in self._migrations():
+            if version >= target:
+                continue
+            logger.info(f"Migrating database schema to v{target}: {migrate.__doc__.strip().splitlines()[0]}")
+            migrate()
+            with self.transaction() as conn:
+                conn.execute(f"PRAGMA user_version = {target}")
+            version = target
+
+    def _migrations(self):
+        """(version, migration) pairs in the order they must be applied."""
+        return [
+            (1, self._migrate_base_schema),
+            (2, self.migrate_legacy_embeddings),
+            (3, self._migrate_file_sizes),
+            (4, self._migrate_face_indexes),
+            (5, self._migrate_person_centroids),
+            (6, self._migrate_face_scores),
+            (7, self._migrate_person_stats),
+            (8, self._migrate_file_hash_index),
+            (9, self._migrate_file_fingerprints),
+            (10, self._migrate_scan_generations),
+            (11, self._migrate_person_stats_order),
+            (12, self._migrate_drop_person_index),
+        ]
+
+    def _migrate_base_schema(self):
+        """Create files, persons and faces tables."""
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+
+            # Files table: Tracks scanned files to skip re-processing
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    hash TEXT,
+                    modified_time REAL,
+                    scanned_at REAL
+                )
+            ''')
+
+            # Persons table: Clusters of faces
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS persons (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT,
+                    thumbnail_path TEXT,
+                    created_at REAL
+                )
+            ''')
+
+            # Faces table: Individual detections
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS faces (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    file_path TEXT,
+                    embedding BLOB,
+                    bbox TEXT,
+                    thumbnail_path TEXT,
+                    person_id INTEGER,
+                    FOREIGN KEY(file_path) REFERENCES files(path),
+                    FOREIGN KEY(person_id) REFERENCES persons(id)
+                )
+            ''')
+
+    def _migrate_file_sizes(self):
+        """Add files.size for change detection."""
+        self._add_column("files", "size", "INTEGER")
+
+    def _migrate_face_indexes(self):
+        """Index faces by person and file, plus a partial index for unclustered faces."""
+        with self.transaction() as conn:
+            # get_photos_by_person / face counts / merge / first thumbnail (covering for file_path)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_faces_person_file ON faces(person_id, file_path)")
+            # Lookups of the faces of one file
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_faces_file_path ON faces(file_path)")
+            # WHERE person_id IS NULL, kept small as faces get clustered
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_faces_unclustered ON faces(id) WHERE person_id IS NULL")
+        self.get_connection().execute("ANALYZE")
+
+    def _migrate_person_centroids(self):
+        """Add persons.centroid / centroid_count for incremental clustering."""
+        # Mean of the person's normalized face embeddings, and how many faces it covers.
+        # NULL means "recompute from faces" (new or merged persons).
+        self._add_column("persons", "centroid", "BLOB")
+        self._add_column("persons", "centroid_count", "INTEGER")
+
+    def _migrate_face_scores(self):
+        """Add faces.det_score and indexes for paging through unclustered faces and persons."""
+        # Faces detected before this column existed get 0
+        self._add_column("faces", "det_score", "REAL NOT NULL DEFAULT 0")
+        with self.transaction() as conn:
+            # Keyset pages of unclustered faces: person_id IS NULL is an equality on this,
+            # so rows come out in (det_score, id) order without a sort. Sorting by id uses
+            # idx_faces_unclustered, sorting by file idx_faces_person_file.
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_faces_person_score ON faces(person_id, det_score)")
+            # Persons sorted by name (unnamed persons sort first)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_persons_name ON persons(IFNULL(name, ''), id)")
+        self.get_connection().execute("ANALYZE")
+
+    def _migrate_person_stats(self):
+        """Add person_stats, per-person counters kept fresh by triggers."""
+        with self.transaction() as conn:
+            # One row per person; a missing row means "recompute" (see refresh_person_stats)
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS person_stats (
+                    person_id INTEGER PRIMARY KEY,
+                    face_count INTEGER NOT NULL,
+                    photo_count INTEGER NOT NULL,
+                    first_seen REAL,
+                    last_seen REAL
+                )
+            ''')
+            # The triggers only drop the rows they make stale, so bulk assignments stay cheap
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS person_stats_face_insert AFTER INSERT ON faces
+                WHEN NEW.person_id IS NOT NULL
+                BEGIN DELETE FROM person_stats WHERE person_id = NEW.person_id; END
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS person_stats_face_update AFTER UPDATE OF person_id, file_path ON faces
+                BEGIN DELETE FROM person_stats WHERE person_id IN (OLD.person_id, NEW.person_id); END
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS person_stats_face_delete AFTER DELETE ON faces
+                WHEN OLD.person_id IS NOT NULL
+                BEGIN DELETE FROM person_stats WHERE person_id = OLD.person_id; END
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS person_stats_person_delete AFTER DELETE ON persons
+                BEGIN DELETE FROM person_stats WHERE person_id = OLD.id; END
+            ''')
+            # First/last seen come from files.modified_time (add_file uses INSERT OR REPLACE)
+            for event in ("INSERT", "UPDATE OF modified_time"):
+                name = "person_stats_file_" + event.split()[0].lower()
+                conn.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON files
+                    BEGIN
+                        DELETE FROM person_stats WHERE person_id IN
+                            (SELECT person_id FROM faces WHERE file_path = NEW.path AND person_id IS NOT NULL);
+                    END
+                ''')
+
+    def _migrate_file_hash_index(self):
+        """Index files by content hash to find moved and duplicate files."""
+        with self.transaction() as conn:
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_files_hash ON files(hash)")
+
+    def _migrate_file_fingerprints(self):
+        """Add files.mtime_ns, inode and hash_algo for cheap change detection."""
+        # (size, mtime_ns, inode) is the change key; NULL for rows scanned before this
+        self._add_column("files", "mtime_ns", "INTEGER")
+        self._add_column("files", "inode", "INTEGER")
+        # Algorithm of files.hash (see fingerprint.py); older rows were hashed with MD5
+        self._add_column("files", "hash_algo", "TEXT")
+        with self.transaction() as conn:
+            conn.execute("UPDATE files SET hash_algo = 'md5' WHERE hash_algo IS NULL AND hash != ''")
+
+    def _migrate_scan_generations(self):
+        """Add files.seen_scan for missing-file detection; invalidate centroids when faces are deleted."""
+        # Generation of the last scan that found the file (see next_scan_generation)
+        self._add_column("files", "seen_scan", "INTEGER")
+        with self.transaction() as conn:
+            # Recomputed by rebuild_missing_centroids on the next clustering run
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS person_centroid_face_delete AFTER DELETE ON faces
+                WHEN OLD.person_id IS NOT NULL
+                BEGIN
+                    UPDATE persons SET centroid = NULL, centroid_count = NULL
+                    WHERE id = OLD.person_id AND centroid IS NOT NULL;
+                END
+            ''')
+
+    def _migrate_person_stats_order(self):
+        """Index person_stats by face count for sorted person pages."""
+        with self.transaction() as conn:
+            # Every person has a row once refresh_person_stats has run (0 for persons without faces)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_person_stats_face_count ON person_stats(face_count, person_id)")
+
+    def _migrate_drop_person_index(self):
+        """Drop idx_faces_person, which the (person_id, ...) indexes already cover."""
+        with self.transaction() as conn:
+            conn.execute("DROP INDEX IF EXISTS idx_faces_person")
+        self.get_connection().execute("ANALYZE")
+
+    def _add_column(self, table: str, column: str, decl: str):
+        """ALTER TABLE ADD COLUMN unless the column already exists."""
+        with self.transaction() as conn:
+            columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+    def migrate_legacy_embeddings(self, batch_size: int = 5000) -> int:
+        """
+        Convert JSON-encoded embeddings left by older versions to the binary format in place.
+        Returns the number of rows converted.
+        """
+        conn = self.get_connection()
+        converted = 0
+        last_id = 0
+        while True:
+            rows = conn.execute('''
+                SELECT id, embedding FROM faces
+                WHERE id > ? AND (typeof(embedding) = 'text' OR hex(substr(embedding, 1, 1)) = '5B')
+                ORDER BY id LIMIT ?
+            ''', (last_id, batch_size)).fetchall()
+            if not rows:
+                break
+
+            updates = []
+            for face_id, emb_data in rows:
+                try:
+                    emb = decode_embedding(emb_data)
+                except Exception as e:
+                    logger.error(f"Failed to migrate embedding for face {face_id}: {e}")
+                    continue
+                updates.append((encode_embedding(emb, self.embedding_dtype), face_id))
+
+            with self.transaction():
+                conn.executemany("UPDATE faces SET embedding = ? WHERE id = ?", updates)
+            converted += len(updates)
+            last_id = rows[-1][0]
+
+        if converted:
+            logger.info(f"Migrated {converted} embeddings from JSON to binary format.")
+        return converted
 
     def get_connection(self):
-        return sqlite3.connect(self.db_path)
+        """Returns the calling thread's persistent connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: we issue BEGIN/COMMIT ourselves in transaction()
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+            self._local.depth = 0
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def release_thread_connection(self):
+        """
+        Closes the calling thread's connection. Short-lived threads (e.g. a scan's
+        pipeline stages) call this on exit, since a Database can outlive many of them.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+        self._local.conn = None
+        self._local.depth = 0
+        with self._connections_lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Groups all writes inside the block into a single commit.
+        Nested blocks join the outermost transaction.
+
+            with db.transaction():
+                db.add_file(...)
+                db.add_faces(...)
+        """
+        conn = self.get_connection()
+        if self._local.depth == 0:
+            conn.execute("BEGIN IMMEDIATE")
+        self._local.depth += 1
+        try:
+            yield conn
+        except BaseException:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                conn.execute("ROLLBACK")
+            raise
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            conn.execute("COMMIT")
+
+    def data_version(self) -> int:
+        """
+        Value that changes whenever any connection, in this process or another,
+        commits to the database. Read on a dedicated connection that never writes,
+        so commits made through this Database's own connections are seen as well.
+        """
+        with self._connections_lock:
+            if self._watch_conn is None:
+                self._watch_conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None,
+                                                   check_same_thread=False)
+            return self._watch_conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def close(self):
+        """Closes every pooled connection. Call once no other thread is using the database."""
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+            if self._watch_conn is not None:
+                self._watch_conn.close()
+                self._watch_conn = None
+        self._local = threading.local()
 
     def file_exists(self, path: str, modified_time: float) -> bool:
         conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT modified_time FROM files WHERE path = ?", (path,))
-        row = cursor.fetchone()
-        conn.close()
-        
+        row = conn.execute("SELECT modified_time FROM files WHERE path = ?", (path,)).fetchone()
+
         if row and row[0] == modified_time:
             return True
         return False
 
-    def add_file(self, path: str, hash_val: str, mtime: float):
+    def load_file_index(self) -> dict:
+        """
+        Returns {path: (modified_time, size, mtime_ns, inode)} for every scanned file,
+        read in one query, so a scan can decide what changed without a point query per
+        file. size, mtime_ns and inode are None for rows written before they were recorded.
+        """
         conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR REPLACE INTO files (path, hash, modified_time, scanned_at)
-            VALUES (?, ?, ?, datetime('now'))
-        ''', (path, hash_val, mtime))
-        conn.commit()
-        conn.close()
+        cursor = conn.execute("SELECT path, modified_time, size, mtime_ns, inode FROM files")
+        index = {}
+        while True:
+            rows = cursor.fetchmany(10000)
+            if not rows:
+                break
+            for row in rows:
+                index[row[0]] = row[1:]
+        return index
+
+    def get_hash_algorithms(self) -> set:
+        """Hash algorithms used by the scanned files."""
+        conn = self.get_connection()
+        rows = conn.execute("SELECT DISTINCT hash_algo FROM files WHERE hash_algo IS NOT NULL AND hash_algo != ?",
+                            (FAILED_HASH_ALGO,))
+        return {r[0] for r in rows}
+
+    def get_paths_by_hash_algorithms(self, algorithms) -> set:
+        """Paths of the scanned files whose recorded hash was computed with one of these algorithms."""
+        conn = self.get_connection()
+        rows = conn.execute("SELECT path FROM files WHERE hash_algo IN (SELECT value FROM json_each(?))",
+                            (json.dumps(list(algorithms)),))
+        return {r[0] for r in rows}
+
+    def update_file_hash(self, path: str, hash_val: str, hash_algo: str):
+        """Replaces the recorded hash of a file, keeping its faces and change key."""
+        with self.transaction() as conn:
+            conn.execute("UPDATE files SET hash = ?, hash_algo = ? WHERE path = ?", (hash_val, hash_algo, path))
+
+    def add_file(self, path: str, hash_val: str, mtime: float, size: int = None,
+                 mtime_ns: int = None, inode: int = None, hash_algo: str = None):
+        with self.transaction() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO files (path, hash, modified_time, size, mtime_ns, inode, hash_algo, scanned_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now'))
+            ''', (path, hash_val, mtime, size, mtime_ns, inode, hash_algo or None))
+
+    def add_failed_file(self, path: str, mtime: float, size: int = None, mtime_ns: int = None, inode: int = None):
+        """
+        Records a file that could not be decoded as an image, with an empty hash, so scans
+        skip it while it is unchanged.
+        """
+        with self.transaction() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO files (path, hash, modified_time, size, mtime_ns, inode, hash_algo, scanned_at)
+                VALUES (?, '', ?, ?, ?, ?, ?, datetime('now'))
+            ''', (path, mtime, size, mtime_ns, inode, FAILED_HASH_ALGO))
+
+    def get_paths_by_hash(self, hash_val: str, hash_algo: str) -> list:
+        """Paths of the scanned files with this content hash (computed with hash_algo)."""
+        if not hash_val:
+            return []
+        conn = self.get_connection()
+        rows = conn.execute("SELECT path FROM files WHERE hash = ? AND hash_algo = ?", (hash_val, hash_algo))
+        return [r[0] for r in rows]
+
+    def move_file(self, old_path: str, new_path: str) -> int:
+        """
+        Re-points the faces of old_path to new_path, keeping face ids, person assignments
+        and thumbnails, and forgets old_path; new_path is then recorded with add_file.
+        Returns the number of faces moved.
+        """
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM faces WHERE file_path = ?", (new_path,))
+            moved = conn.execute("UPDATE faces SET file_path = ? WHERE file_path = ?",
+                                 (new_path, old_path)).rowcount
+            conn.execute("DELETE FROM files WHERE path = ?", (old_path,))
+            return moved
+
+    def copy_faces(self, source_path: str, target_path: str) -> int:
+        """
+        Copies the faces of source_path (embeddings, boxes, thumbnails and persons) to
+        target_path, replacing any faces it had. Returns the number of faces copied.
+        """
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM faces WHERE file_path = ?", (target_path,))
+            return conn.execute('''
+                INSERT INTO faces (file_path, embedding, bbox, thumbnail_path, det_score, person_id)
+                SELECT ?, embedding, bbox, thumbnail_path, det_score, person_id
+                FROM faces WHERE file_path = ? ORDER BY id
+            ''', (target_path, source_path)).rowcount
+
+    def delete_faces(self, file_path: str) -> int:
+        """Deletes the faces found in one file. Returns how many."""
+        with self.transaction() as conn:
+            return conn.execute("DELETE FROM faces WHERE file_path = ?", (file_path,)).rowcount
+
+    def next_scan_generation(self) -> int:
+        """Generation number for a new scan, newer than any file's seen_scan."""
+        conn = self.get_connection()
+        return conn.execute("SELECT IFNULL(MAX(seen_scan), 0) + 1 FROM files").fetchone()[0]
+
+    def mark_files_seen(self, paths, generation: int):
+        """Records that the scan with this generation found these files."""
+        with self.transaction() as conn:
+            conn.execute("UPDATE files SET seen_scan = ? WHERE path IN (SELECT value FROM json_each(?))",
+                         (generation, json.dumps(list(paths))))
+
+    def get_unseen_files(self, prefix: str, generation: int, after: str = None, limit: int = 1000) -> list:
+        """
+        Paths under prefix (a folder path ending with a separator) that the scan with
+        this generation did not find, in path order after `after`; a page of at most limit.
+        """
+        # Paths starting with prefix sort between it and the prefix with its last character bumped
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        conn = self.get_connection()
+        rows = conn.execute('''
+            SELECT path FROM files
+            WHERE path >= ? AND path < ? AND path > ? AND (seen_scan IS NULL OR seen_scan < ?)
+            ORDER BY path LIMIT ?
+        ''', (prefix, upper, after or "", generation, limit))
+        return [r[0] for r in rows]
+
+    def remove_files(self, paths) -> int:
+        """Forgets files that no longer exist, with their faces. Returns how many files were removed."""
+        paths = json.dumps(list(paths))
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM faces WHERE file_path IN (SELECT value FROM json_each(?))", (paths,))
+            return conn.execute("DELETE FROM files WHERE path IN (SELECT value FROM json_each(?))",
+                                (paths,)).rowcount
 
     def add_faces(self, file_path: str, faces: list):
         """
         Stores detected faces in the 'faces' table.
         faces = [{'embedding': [...], 'bbox': [...], 'thumbnail': '...', ...}, ...]
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
+        rows = []
         for face in faces:
-            emb_json = json.dumps(face['embedding'])
+            emb_blob = encode_embedding(face['embedding'], self.embedding_dtype)
             bbox_json = json.dumps(face['bbox'])
             thumbnail = face.get('thumbnail')
-            
-            cursor.execute('''
-                INSERT INTO faces (file_path, embedding, bbox, thumbnail_path)
-                VALUES (?, ?, ?, ?)
-            ''', (file_path, emb_json, bbox_json, thumbnail))
-            
-        conn.commit()
-        conn.close()
+            rows.append((file_path, emb_blob, bbox_json, thumbnail, float(face.get('det_score', 0))))
+
+        with self.transaction() as conn:
+            conn.executemany('''
+                INSERT INTO faces (file_path, embedding, bbox, thumbnail_path, det_score)
+                VALUES (?, ?, ?, ?, ?)
+            ''', rows)
 
     def get_unclustered_faces(self):
         """Returns list of (face_id, embedding_bytes) for faces with no person_id"""
         conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, embedding FROM faces WHERE person_id IS NULL")
-        rows = cursor.fetchall()
-        conn.close()
+        rows = conn.execute("SELECT id, embedding FROM faces WHERE person_id IS NULL").fetchall()
         return rows # [(id, bytes), ...]
 
+    def get_unclustered_embeddings(self):
+        """
+        Returns (face_ids, embeddings) for faces with no person_id as
+        an int64 array and a contiguous (n, dim) float32 matrix.
+        """
+        conn = self.get_connection()
+        rows = conn.execute("SELECT id, embedding FROM faces WHERE person_id IS NULL ORDER BY id").fetchall()
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+
+        ids, blobs = zip(*rows)
+        return np.array(ids, dtype=np.int64), decode_matrix(blobs)
+
+    def get_unclustered_face_ids(self):
+        """Returns int64 ids of faces with no person_id (served from the partial index)."""
+        conn = self.get_connection()
+        rows = conn.execute("SELECT id FROM faces WHERE person_id IS NULL ORDER BY id").fetchall()
+        return np.array([r[0] for r in rows], dtype=np.int64)
+
+    def get_face_count(self) -> int:
+        conn = self.get_connection()
+        return conn.execute("SELECT COUNT(*) FROM faces").fetchone()[0]
+
+    def get_max_face_id(self) -> int:
+        conn = self.get_connection()
+        return conn.execute("SELECT COALESCE(MAX(id), 0) FROM faces").fetchone()[0]
+
+    def get_face_id_sequence(self) -> int:
+        """
+        Highest face id ever issued. faces uses AUTOINCREMENT, so ids of deleted
+        faces are never reused and this never goes down, unlike MAX(id).
+        """
+        conn = self.get_connection()
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'faces'").fetchone()
+        return max(row[0] if row else 0, self.get_max_face_id())
+
+    def get_embeddings_after(self, last_id: int, limit: int):
+        """Returns (face_ids, embeddings) for up to `limit` faces with id > last_id, in id order."""
+        conn = self.get_connection()
+        rows = conn.execute("SELECT id, embedding FROM faces WHERE id > ? ORDER BY id LIMIT ?",
+                            (last_id, limit)).fetchall()
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+
+        ids, blobs = zip(*rows)
+        return np.array(ids, dtype=np.int64), decode_matrix(blobs)
+
     def get_unclustered_faces_info(self):
         """Returns list of (id, file_path, bbox, thumbnail_path) for UI display"""
         conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, file_path, bbox, thumbnail_path FROM faces WHERE person_id IS NULL")
-        rows = cursor.fetchall()
-        conn.close()
-        return rows
+        return conn.execute("SELECT id, file_path, bbox, thumbnail_path FROM faces WHERE person_id IS NULL").fetchall()
 
-    def create_person(self, name=None):
+    # Keyset sort orders: name -> (order columns, descending)
+    UNCLUSTERED_SORTS = {
+        "id": (("id",), False),
+        "det_score": (("det_score", "id"), True),
+        "file": (("file_path", "id"), False),
+    }
+    PERSON_SORTS = {
+        "id": (("p.id",), False),
+        "name": (("IFNULL(p.name, '')", "p.id"), False),
+        # Reads PERSONS_BY_FACE_COUNT_SELECT, so the order columns are plain indexed ones
+        "face_count": (("s.face_count", "s.person_id"), True),
+    }
+
+    def _page(self, select: str, where: list, params: list, order, descending: bool,
+              limit: int, cursor=None, offset: int = None):
+        """
+        Runs one page of `select` (which must not have WHERE/ORDER BY clauses).
+
+        Pages continue after `cursor`, the values of the order columns of the last row
+        of the previous page (keyset pagination, an index range scan), or skip `offset`
+        rows when no cursor is given. Returns (rows, next_cursor); next_cursor is None
+        on the last page.
+        """
+        where, params = list(where), list(params)
+        if cursor is not None:
+            if len(cursor) != len(order):
+                raise ValueError(f"Cursor must have {len(order)} values")
+            placeholders = ", ".join("?" * len(order))
+            where.append(f"({', '.join(order)}) {'<' if descending else '>'} ({placeholders})")
+            params.extend(cursor)
+            if len(order) > 1:
+                # Bound on the first column alone, which SQLite can also use on expression indexes
+                where.append(f"{order[0]} {'<=' if descending else '>='} ?")
+                params.append(cursor[0])
+
+        direction = "DESC" if descending else "ASC"
+        # The order columns are selected too, at the end of each row, to build the next cursor
+        columns, from_clause = select.split(" FROM ", 1)
+        sql = f"SELECT {columns}, {', '.join(order)} FROM {from_clause}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY " + ", ".join(f"{col} {direction}" for col in order) + " LIMIT ?"
+        params.append(limit)
+        if offset and cursor is None:
+            sql += " OFFSET ?"
+            params.append(offset)
+
+        rows = self.get_connection().execute(sql, params).fetchall()
+        n = len(order)
+        next_cursor = list(rows[-1][-n:]) if rows and len(rows) == limit else None
+        return [row[:-n] for row in rows], next_cursor
+
+    @staticmethod
+    def _folder_range(folder: str):
+        """Bounds of file paths inside folder, as a range usable by the file_path index."""
+        prefix = os.path.join(folder, "")
+        return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+    def get_unclustered_faces_page(self, limit: int, cursor=None, offset: int = None, sort: str = "id",
+                                   file_path: str = None, folder: str = None, min_det_score: float = None):
+        """
+        One page of unclustered faces as (rows, next_cursor), rows being
+        (id, file_path, bbox, thumbnail_path, det_score).
+
+        sort: "id" (oldest first), "det_score" (most confident first) or "file".
+        Filters: an exact file_path, every file under folder, a minimum det_score.
+        """
+        if sort not in self.UNCLUSTERED_SORTS:
+            raise ValueError(f"Unknown sort: {sort}")
+        order, descending = self.UNCLUSTERED_SORTS[sort]
+        where, params = ["person_id IS NULL"], []
+        if file_path is not None:
+            where.append("file_path = ?")
+            params.append(file_path)
+        if folder is not None:
+            where.append("file_path >= ? AND file_path < ?")
+            params.extend(self._folder_range(folder))
+        if min_det_score is not None:
+            where.append("det_score >= ?")
+            params.append(float(min_det_score))
+        return self._page("id, file_path, bbox, thumbnail_path, det_score FROM faces", where, params,
+                          order, descending, limit, cursor, offset)
+
+    def get_persons_page(self, limit: int, cursor=None, offset: int = None, sort: str = "id"):
+        """One page of persons as (rows, next_cursor), rows as returned by get_persons."""
+        if sort not in self.PERSON_SORTS:
+            raise ValueError(f"Unknown sort: {sort}")
+        order, descending = self.PERSON_SORTS[sort]
+        self.refresh_person_stats()
+        select = self.PERSONS_BY_FACE_COUNT_SELECT if sort == "face_count" else self.PERSONS_SELECT
+        return self._page(select, [], [], order, descending, limit, cursor, offset)
+
+    def get_faces_by_ids(self, face_ids):
+        """Returns {face_id: (file_path, bbox, thumbnail_path, person_id)} for the given ids that exist."""
+        face_ids = [int(i) for i in face_ids]
+        if not face_ids:
+            return {}
         conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO persons (name, created_at) VALUES (?, datetime('now'))", (name,))
-        person_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return person_id
-        
+        rows = conn.execute(
+            "SELECT f.id, f.file_path, f.bbox, f.thumbnail_path, f.person_id "
+            "FROM json_each(?) j JOIN faces f ON f.id = j.value",
+            (json.dumps(face_ids),)
+        ).fetchall()
+        return {row[0]: row[1:] for row in rows}
+
+    def get_face_ids_by_person(self, person_id: int) -> np.ndarray:
+        conn = self.get_connection()
+        rows = conn.execute("SELECT id FROM faces WHERE person_id = ? ORDER BY id", (person_id,)).fetchall()
+        return np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+
+    def get_person_centroid(self, person_id: int):
+        """Returns the stored centroid of one person as a float32 vector, or None."""
+        conn = self.get_connection()
+        row = conn.execute("SELECT centroid FROM persons WHERE id = ?", (person_id,)).fetchone()
+        return decode_embedding(row[0]) if row and row[0] is not None else None
+
+    def create_person(self, name=None):
+        with self.transaction() as conn:
+            cursor = conn.execute("INSERT INTO persons (name, created_at) VALUES (?, datetime('now'))", (name,))
+            return cursor.lastrowid
+
     def update_face_person(self, face_id, person_id):
+        with self.transaction() as conn:
+            conn.execute("UPDATE faces SET person_id = ? WHERE id = ?", (person_id, face_id))
+
+    def create_persons(self, names) -> list:
+        """Inserts one person per name in a single transaction and returns their ids in order."""
+        with self.transaction() as conn:
+            ids = []
+            for name in names:
+                cursor = conn.execute("INSERT INTO persons (name, created_at) VALUES (?, datetime('now'))", (name,))
+                ids.append(cursor.lastrowid)
+            return ids
+
+    def assign_faces(self, face_ids, person_ids):
+        """Bulk-assigns faces to persons: face_ids[i] -> person_ids[i]."""
+        with self.transaction() as conn:
+            conn.executemany("UPDATE faces SET person_id = ? WHERE id = ?",
+                             zip(map(int, person_ids), map(int, face_ids)))
+
+    def set_person_thumbnails_from_faces(self, person_ids, face_ids):
+        """
+        Sets each person's thumbnail to the given face's thumbnail, falling back to
+        any other face of that person when the chosen face has none.
+        """
+        with self.transaction() as conn:
+            conn.executemany('''
+                UPDATE persons SET thumbnail_path = COALESCE(
+                    (SELECT thumbnail_path FROM faces WHERE id = ?),
+                    (SELECT thumbnail_path FROM faces WHERE person_id = persons.id AND thumbnail_path IS NOT NULL LIMIT 1)
+                )
+                WHERE id = ?
+            ''', zip(map(int, face_ids), map(int, person_ids)))
+
+    def get_person_centroids(self):
+        """
+        Returns (person_ids, centroids, counts) for persons with a stored centroid:
+        int64 ids, an (n, dim) float32 matrix of mean normalized embeddings, int64 face counts.
+        """
         conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("UPDATE faces SET person_id = ? WHERE id = ?", (person_id, face_id))
-        conn.commit()
-        conn.close()
-        
+        rows = conn.execute(
+            "SELECT id, centroid, centroid_count FROM persons WHERE centroid IS NOT NULL ORDER BY id"
+        ).fetchall()
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=np.int64)
+
+        ids, blobs, counts = zip(*rows)
+        return np.array(ids, dtype=np.int64), decode_matrix(blobs), np.array(counts, dtype=np.int64)
+
+    def set_person_centroids(self, person_ids, centroids, counts):
+        """Stores centroid/count per person (always float32 so running means stay precise)."""
+        with self.transaction() as conn:
+            conn.executemany(
+                "UPDATE persons SET centroid = ?, centroid_count = ? WHERE id = ?",
+                [(encode_embedding(c, "float32"), int(n), int(pid)) for pid, c, n in zip(person_ids, centroids, counts)]
+            )
+
+    def rebuild_missing_centroids(self) -> int:
+        """Computes centroids for persons that have faces but no stored centroid. Returns how many."""
+        conn = self.get_connection()
+        rows = conn.execute('''
+            SELECT f.person_id, f.embedding FROM faces f
+            JOIN persons p ON p.id = f.person_id
+            WHERE p.centroid IS NULL
+            ORDER BY f.person_id
+        ''').fetchall()
+        if not rows:
+            return 0
+
+        pids, blobs = zip(*rows)
+        pids = np.array(pids, dtype=np.int64)
+        X = normalize_rows(decode_matrix(blobs))
+        person_ids, starts, counts = np.unique(pids, return_index=True, return_counts=True)
+        centroids = np.add.reduceat(X, starts, axis=0) / counts[:, None]
+        self.set_person_centroids(person_ids, centroids, counts)
+        return len(person_ids)
+
+    # Persons with their counters; every person has a person_stats row after refresh_person_stats
+    PERSONS_SELECT = (
+        "p.id, p.name, p.thumbnail_path, p.created_at, IFNULL(s.face_count, 0), IFNULL(s.photo_count, 0), "
+        "s.first_seen, s.last_seen FROM persons p LEFT JOIN person_stats s ON s.person_id = p.id"
+    )
+    # The same rows driven by person_stats, to walk idx_person_stats_face_count in order
+    PERSONS_BY_FACE_COUNT_SELECT = (
+        "p.id, p.name, p.thumbnail_path, p.created_at, s.face_count, s.photo_count, "
+        "s.first_seen, s.last_seen FROM person_stats s CROSS JOIN persons p ON p.id = s.person_id"
+    )
+
+    def refresh_person_stats(self) -> int:
+        """
+        Recomputes person_stats for persons whose row is missing (new persons, or
+        rows dropped by the triggers), in one GROUP BY over their faces; persons
+        without faces get a row of zeros. Returns how many persons were recomputed.
+        """
+        conn = self.get_connection()
+        stale = "SELECT id FROM persons WHERE id NOT IN (SELECT person_id FROM person_stats)"
+        # Read-only check first so loading the people list takes no write lock when nothing changed
+        if conn.execute(f"SELECT EXISTS ({stale})").fetchone()[0] == 0:
+            return 0
+        with self.transaction() as conn:
+            cursor = conn.execute(f'''
+                INSERT OR REPLACE INTO person_stats (person_id, face_count, photo_count, first_seen, last_seen)
+                SELECT p.id, COUNT(f.id), COUNT(DISTINCT f.file_path), MIN(fl.modified_time), MAX(fl.modified_time)
+                FROM persons p
+                LEFT JOIN faces f ON f.person_id = p.id
+                LEFT JOIN files fl ON fl.path = f.file_path
+                WHERE p.id IN ({stale})
+                GROUP BY p.id
+            ''')
+            return cursor.rowcount
+
     def get_persons(self):
+        """
+        Returns (id, name, thumbnail_path, created_at, face_count, photo_count,
+        first_seen, last_seen) per person; first/last seen are file modification times.
+        """
+        self.refresh_person_stats()
         conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM persons")
-        rows = cursor.fetchall()
-        conn.close()
-        return rows
+        return conn.execute(f"SELECT {self.PERSONS_SELECT} ORDER BY p.id").fetchall()
 
     def get_photos_by_person(self, person_id: int):
         """Returns list of unique file paths containing this person."""
         conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT DISTINCT file_path FROM faces WHERE person_id = ?", (person_id,))
-        rows = cursor.fetchall()
-        conn.close()
+        rows = conn.execute("SELECT DISTINCT file_path FROM faces WHERE person_id = ?", (person_id,)).fetchall()
         return [r[0] for r in rows]
 
     def get_person_face_count(self, person_id: int) -> int:
         """Returns count of faces belonging to a person."""
         conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM faces WHERE person_id = ?", (person_id,))
-        count = cursor.fetchone()[0]
-        conn.close()
-        return count
+        return conn.execute("SELECT COUNT(*) FROM faces WHERE person_id = ?", (person_id,)).fetchone()[0]
 
     def rename_person(self, person_id: int, new_name: str):
         """Rename a person."""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("UPDATE persons SET name = ? WHERE id = ?", (new_name, person_id))
-        conn.commit()
-        conn.close()
+        with self.transaction() as conn:
+            conn.execute("UPDATE persons SET name = ? WHERE id = ?", (new_name, person_id))
 
     def merge_persons(self, keep_person_id: int, merge_person_id: int):
         """
         Merge two persons: move all faces from merge_person to keep_person,
         then delete merge_person.
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        # Move all faces from merge_person to keep_person
-        cursor.execute("UPDATE faces SET person_id = ? WHERE person_id = ?", 
-                      (keep_person_id, merge_person_id))
-        # Delete the merged person
-        cursor.execute("DELETE FROM persons WHERE id = ?", (merge_person_id,))
-        conn.commit()
-        conn.close()
+        with self.transaction() as conn:
+            # Move all faces from merge_person to keep_person
+            conn.execute("UPDATE faces SET person_id = ? WHERE person_id = ?",
+                         (keep_person_id, merge_person_id))
+            # Delete the merged person
+            conn.execute("DELETE FROM persons WHERE id = ?", (merge_person_id,))
+            # Centroid is recomputed from the combined faces on the next clustering run
+            conn.execute("UPDATE persons SET centroid = NULL, centroid_count = NULL WHERE id = ?",
+                         (keep_person_id,))
 
     def update_person_thumbnail(self, person_id: int, thumbnail_path: str):
         """Set thumbnail for a person."""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("UPDATE persons SET thumbnail_path = ? WHERE id = ?", 
-                      (thumbnail_path, person_id))
-        conn.commit()
-        conn.close()
+        with self.transaction() as conn:
+            conn.execute("UPDATE persons SET thumbnail_path = ? WHERE id = ?",
+                         (thumbnail_path, person_id))
 
     def get_first_face_thumbnail(self, person_id: int):
         """Get the thumbnail path of the first face for a person."""
         conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
+        row = conn.execute(
             "SELECT thumbnail_path FROM faces WHERE person_id = ? AND thumbnail_path IS NOT NULL LIMIT 1",
             (person_id,)
-        )
-        row = cursor.fetchone()
-        conn.close()
+        ).fetchone()
         return row[0] if row else None
-
@@ -0,0 +1,165 @@
+import sys
+import json
+import logging
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("FaceFrameDispatcher")
+
+# Threads answering read-only queries (run alongside long jobs)
+QUERY_WORKERS = 4
+# Threads running write jobs (scans, clustering, edits); one per library at a time
+JOB_WORKERS = 2
+
+# Command kinds
+INLINE = "inline"  # handled on the stdin thread (must return immediately)
+QUERY = "query"    # read-only, runs concurrently on the query pool
+WRITE = "write"    # modifies a library, serialized per library on the job pool
+EDIT = "edit"      # short WRITE; later queries of the library wait for it (read-your-writes)
+
+_emit_lock = threading.Lock()
+
+
+def emit(message: dict):
+    """Writes one JSON message line to stdout. Safe to call from any thread."""
+    line = json.dumps(message) + "\n"
+    with _emit_lock:
+        sys.stdout.write(line)
+        sys.stdout.flush()
+
+
+class Dispatcher:
+    """
+    Routes commands to handlers on bounded thread pools.
+
+    Handlers are registered with a kind (INLINE, QUERY or WRITE) and called as
+    handler(cmd, reply). reply(message) emits a message tagged with the command's
+    request_id (taken from the command, or assigned here when missing), so clients
+    can match responses to requests. WRITE and EDIT commands that carry a library
+    `path` run one at a time per library, in arrival order. A handler may come with
+    prepare(cmd, reply), called when the command is dispatched (before it waits for
+    its turn) and returning the command the handler receives.
+
+    A QUERY on a library starts only after the EDITs sent before it for that library
+    have finished, so e.g. GET_PERSONS right after RENAME_PERSON sees the new name.
+    It does not wait for long WRITE jobs (scans, clustering), unless an EDIT is
+    queued behind one. Held queries are attached to the edit they wait for rather
+    than blocking a pool thread.
+    """
+
+    def __init__(self, library_key=None, query_workers: int = QUERY_WORKERS, job_workers: int = JOB_WORKERS):
+        self._handlers = {}
+        self._library_key = library_key or (lambda path: path)
+        self._queries = ThreadPoolExecutor(max_workers=query_workers, thread_name_prefix="Query")
+        self._jobs = ThreadPoolExecutor(max_workers=job_workers, thread_name_prefix="Job")
+        self._ids = itertools.count(1)
+        # library key -> deque of pending write jobs; present while one is running
+        self._write_queues = {}
+        # library key -> queries waiting for the most recently dispatched EDIT
+        self._edit_waiters = {}
+        self._write_lock = threading.Lock()
+
+    def register(self, action: str, handler, kind: str = QUERY, prepare=None):
+        self._handlers[action] = (handler, kind, prepare)
+
+    def dispatch(self, cmd: dict):
+        """Schedules one parsed command."""
+        action = cmd.get('action')
+        request_id = cmd.get('request_id')
+        if request_id is None:
+            request_id = f"r{next(self._ids)}"
+
+        def reply(message: dict):
+            emit({**message, "request_id": request_id})
+
+        if action not in self._handlers:
+            logger.warning(f"Unknown action: {action}")
+            reply({"status": "request_error", "action": action, "message": f"Unknown action: {action}"})
+            return
+
+        handler, kind, prepare = self._handlers[action]
+        if prepare is not None:
+            try:
+                cmd = prepare(cmd, reply)
+            except Exception as e:
+                logger.exception(f"{action} failed: {e}")
+                reply({"status": "request_error", "action": action, "message": str(e)})
+                return
+        job = lambda: self._run(handler, cmd, reply)
+        if kind == INLINE:
+            job()
+        elif kind in (WRITE, EDIT) and cmd.get('path'):
+            key = self._library_key(cmd['path'])
+            if kind == EDIT:
+                job = self._edit(key, job)
+            self._submit_write(key, job)
+        elif kind in (WRITE, EDIT):
+            self._jobs.submit(job)
+        elif cmd.get('path'):
+            self._submit_query(self._library_key(cmd['path']), job)
+        else:
+            self._queries.submit(job)
+
+    def _run(self, handler, cmd, reply):
+        try:
+            handler(cmd, reply)
+        except Exception as e:
+            logger.exception(f"{cmd.get('action')} failed: {e}")
+            reply({"status": "request_error", "action": cmd.get('action'), "message": str(e)})
+
+    def _edit(self, key, job):
+        """Wraps an EDIT so the queries dispatched after it are released when it finishes."""
+        waiters = []
+        with self._write_lock:
+            self._edit_waiters[key] = waiters
+
+        def run():
+            try:
+                job()
+            finally:
+                with self._write_lock:
+                    if self._edit_waiters.get(key) is waiters:
+                        del self._edit_waiters[key]
+                    released = list(waiters)
+                    waiters.clear()
+                for query in released:
+                    self._queries.submit(query)
+        return run
+
+    def _submit_query(self, key, job):
+        with self._write_lock:
+            waiters = self._edit_waiters.get(key)
+            if waiters is not None:
+                # Edits run in order, so this one finishes after every earlier one
+                waiters.append(job)
+                return
+        self._queries.submit(job)
+
+    def _submit_write(self, key, job):
+        with self._write_lock:
+            queue = self._write_queues.get(key)
+            if queue is not None:
+                # A write for this library is running; it picks this one up when done
+                queue.append(job)
+                return
+            self._write_queues[key] = deque()
+        self._jobs.submit(self._drain_writes, key, job)
+
+    def _drain_writes(self, key, job):
+        while job is not None:
+            job()
+            with self._write_lock:
+                queue = self._write_queues[key]
+                if queue:
+                    job = queue.popleft()
+                else:
+                    del self._write_queues[key]
+                    job = None
+
+    def shutdown(self, wait: bool = True):
+        """Stops accepting work; with wait=True, returns once queued jobs have finished."""
+        self._queries.shutdown(wait=wait)
+        # Queued writes run inside the job draining their library's queue
+        self._jobs.shutdown(wait=wait)
@@ -0,0 +1,103 @@
+import json
+import struct
+import logging
+import numpy as np
+
+logger = logging.getLogger("FaceFrameEmbeddings")
+
+# Binary embedding layout stored in faces.embedding:
+#   2 bytes  magic   b"FE"
+#   1 byte   format version
+#   1 byte   dtype code (see DTYPE_CODES)
+#   N bytes  raw little-endian vector
+MAGIC = b"FE"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<2sBB")
+HEADER_SIZE = HEADER.size
+
+DTYPE_CODES = {
+    "float32": 1,
+    "float16": 2,
+}
+CODE_DTYPES = {
+    1: np.dtype("<f4"),
+    2: np.dtype("<f2"),
+}
+
+
+def encode_embedding(embedding, dtype: str = "float32") -> bytes:
+    """Packs an embedding (list or ndarray) into the tagged binary format."""
+    if dtype not in DTYPE_CODES:
+        raise ValueError(f"Unsupported embedding dtype: {dtype}")
+    code = DTYPE_CODES[dtype]
+    vec = np.asarray(embedding, dtype=CODE_DTYPES[code])
+    return HEADER.pack(MAGIC, FORMAT_VERSION, code) + vec.tobytes()
+
+
+def is_legacy(blob) -> bool:
+    """True if the stored value is a pre-binary JSON embedding."""
+    if isinstance(blob, str):
+        return True
+    return bool(blob) and blob[:1] == b"["
+
+
+def decode_embedding(blob) -> np.ndarray:
+    """Decodes a single stored embedding (binary or legacy JSON) to float32."""
+    if is_legacy(blob):
+        if isinstance(blob, bytes):
+            blob = blob.decode("utf-8")
+        return np.array(json.loads(blob), dtype=np.float32)
+
+    magic, version, code = HEADER.unpack_from(blob)
+    if magic != MAGIC or version != FORMAT_VERSION or code not in CODE_DTYPES:
+        raise ValueError(f"Unrecognized embedding header: {magic!r} v{version} dtype={code}")
+    return np.frombuffer(blob, dtype=CODE_DTYPES[code], offset=HEADER_SIZE).astype(np.float32)
+
+
+def decode_matrix(blobs) -> np.ndarray:
+    """
+    Decodes a sequence of binary embeddings into one contiguous (n, dim) float32 matrix.
+    All rows are joined into a single buffer and reinterpreted with np.frombuffer,
+    so no per-row arrays are created. Rows of mixed dtypes are decoded per dtype group.
+    """
+    n = len(blobs)
+    if n == 0:
+        return np.empty((0, 0), dtype=np.float32)
+
+    lengths = np.fromiter(map(len, blobs), dtype=np.int64, count=n)
+    if np.all(lengths == lengths[0]):
+        return _decode_uniform(b"".join(blobs), n, int(lengths[0]))
+
+    # Mixed float32/float16 rows: decode each length group separately
+    out = None
+    for length in np.unique(lengths):
+        idx = np.flatnonzero(lengths == length)
+        part = _decode_uniform(b"".join([blobs[i] for i in idx]), len(idx), int(length))
+        if out is None:
+            out = np.empty((n, part.shape[1]), dtype=np.float32)
+        elif part.shape[1] != out.shape[1]:
+            raise ValueError("Embeddings have inconsistent dimensions")
+        out[idx] = part
+    return out
+
+
+def _decode_uniform(buf: bytes, n: int, row_size: int) -> np.ndarray:
+    raw = np.frombuffer(buf, dtype=np.uint8).reshape(n, row_size)
+    header = raw[:, :HEADER_SIZE]
+    first = bytes(header[0])
+    if not np.all(header == header[0]):
+        raise ValueError("Embedding rows of equal size have different headers")
+
+    magic, version, code = HEADER.unpack(first)
+    if magic != MAGIC or version != FORMAT_VERSION or code not in CODE_DTYPES:
+        raise ValueError(f"Unrecognized embedding header: {magic!r} v{version} dtype={code}")
+
+    payload = np.ascontiguousarray(raw[:, HEADER_SIZE:])
+    return payload.view(CODE_DTYPES[code]).astype(np.float32, copy=False)
+
+
+def normalize_rows(X: np.ndarray) -> np.ndarray:
+    """L2-normalizes each row (zero rows are left as zeros)."""
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    norms[norms == 0] = 1  # Prevent division by zero
+    return X / norms
@@ -0,0 +1,119 @@
+import logging
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from ivf import FLAT_INDEX_LIMIT, IVF_NPROBE, build_ivf_index
+
+try:
+    import faiss
+except ImportError:
+    logging.warning("faiss not installed; FAISS clustering engine unavailable")
+    faiss = None
+
+logger = logging.getLogger("FaceFrameFaissClustering")
+
+# Queries per range_search call (bounds the size of each result batch)
+QUERY_BATCH = 4096
+
+
+def is_available() -> bool:
+    return faiss is not None
+
+
+class FaissDBSCAN:
+    """
+    DBSCAN-equivalent clustering of L2-normalized vectors on a FAISS index.
+
+    The eps-neighbourhood graph is built with batched range searches (inner product
+    >= 1 - eps^2 / 2, which equals euclidean distance <= eps on unit vectors).
+    Points with at least min_samples neighbours (self included, as in scikit-learn)
+    are core points; connected components of the core-core graph form clusters, and
+    each border point joins the cluster of its most similar core neighbour.
+    """
+
+    def __init__(self, eps: float = 0.5, min_samples: int = 2, flat_limit: int = FLAT_INDEX_LIMIT,
+                 nprobe: int = IVF_NPROBE):
+        if faiss is None:
+            raise ImportError("faiss package is missing")
+        self.eps = eps
+        self.min_samples = min_samples
+        self.flat_limit = flat_limit
+        self.nprobe = nprobe
+        self.labels_ = None
+
+    def fit(self, X, progress_callback=None, abort_check=None):
+        """
+        progress_callback(done, n) is called after each query batch. If abort_check()
+        returns True between batches, fitting stops and labels_ is left as None.
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n = X.shape[0]
+        threshold = 1.0 - (self.eps ** 2) / 2.0
+        self.labels_ = None
+
+        index = self._build_index(X)
+        graph = self._range_graph(index, X, threshold, progress_callback, abort_check)
+        if graph is None:
+            return self
+        rows, cols, sims = graph
+
+        counts = np.bincount(rows, minlength=n)
+        core = counts >= self.min_samples
+        labels = np.full(n, -1, dtype=np.int64)
+        if not core.any():
+            self.labels_ = labels
+            return self
+
+        # Clusters = connected components of the core-core subgraph
+        core_idx = np.flatnonzero(core)
+        core_pos = np.full(n, -1, dtype=np.int64)
+        core_pos[core_idx] = np.arange(len(core_idx))
+        cc = core[rows] & core[cols]
+        graph = coo_matrix(
+            (np.ones(int(cc.sum()), dtype=np.int8), (core_pos[rows[cc]], core_pos[cols[cc]])),
+            shape=(len(core_idx), len(core_idx))
+        )
+        _, components = connected_components(graph, directed=False)
+
+        # Number clusters in order of their first point, like scikit-learn
+        _, first, remapped = np.unique(components, return_index=True, return_inverse=True)
+        order = np.argsort(np.argsort(first))
+        labels[core_idx] = order[remapped]
+
+        # Border points: non-core with a core neighbour -> most similar core neighbour's cluster
+        border = ~core[rows] & core[cols]
+        if border.any():
+            b_rows, b_cols, b_sims = rows[border], cols[border], sims[border]
+            best = np.lexsort((-b_sims, b_rows))
+            b_rows, b_cols = b_rows[best], b_cols[best]
+            uniq_rows, first_edge = np.unique(b_rows, return_index=True)
+            labels[uniq_rows] = labels[b_cols[first_edge]]
+
+        self.labels_ = labels
+        return self
+
+    def fit_predict(self, X, progress_callback=None, abort_check=None):
+        return self.fit(X, progress_callback, abort_check).labels_
+
+    def _build_index(self, X):
+        n, d = X.shape
+        if n <= self.flat_limit:
+            index = faiss.IndexFlatIP(d)
+        else:
+            index = build_ivf_index(X, self.nprobe)
+        index.add(X)
+        return index
+
+    def _range_graph(self, index, X, threshold, progress_callback=None, abort_check=None):
+        """Returns edge arrays (rows, cols, sims) of the eps-neighbourhood graph, or None if aborted."""
+        rows, cols, sims = [], [], []
+        for start in range(0, X.shape[0], QUERY_BATCH):
+            if abort_check is not None and abort_check():
+                return None
+            lims, D, I = index.range_search(X[start:start + QUERY_BATCH], threshold)
+            rows.append(np.repeat(np.arange(start, start + len(lims) - 1), np.diff(lims).astype(np.int64)))
+            cols.append(I)
+            sims.append(D)
+            if progress_callback is not None:
+                progress_callback(min(start + QUERY_BATCH, X.shape[0]), X.shape[0])
+        return np.concatenate(rows), np.concatenate(cols).astype(np.int64), np.concatenate(sims)
@@ -0,0 +1,131 @@
+import hashlib
+import logging
+
+try:
+    import xxhash
+except ImportError:
+    logging.warning("xxhash not installed; file fingerprints use BLAKE2b")
+    xxhash = None
+
+logger = logging.getLogger("FaceFrameFingerprint")
+
+# Full-content hash for new rows: xxh3 when available (memory speed), else BLAKE2b
+# (faster than MD5 in pure hashlib). Rows written before this module record "md5".
+DEFAULT_ALGORITHM = "xxh3_128" if xxhash is not None else "blake2b"
+LEGACY_ALGORITHM = "md5"
+
+# Bytes read per step when hashing a file from disk
+READ_CHUNK = 1 << 20  # 1 MB
+
+# Hash modes
+FULL = "full"        # hash every byte
+SAMPLED = "sampled"  # files of at least SAMPLE_MIN_SIZE: size + head, middle and tail blocks
+
+SAMPLE_MIN_SIZE = 16 << 20  # 16 MB
+SAMPLE_BLOCK = 1 << 20      # 1 MB per sampled block
+# Appended to the algorithm name of sampled fingerprints, which never equal full ones
+SAMPLED_SUFFIX = "+sampled"
+
+
+def new_hasher(algorithm: str):
+    """Returns a hashlib-style object (update/hexdigest) for an algorithm name."""
+    if algorithm == "xxh3_128":
+        if xxhash is None:
+            raise ValueError("xxh3_128 fingerprints need the xxhash package")
+        return xxhash.xxh3_128()
+    if algorithm == "blake2b":
+        return hashlib.blake2b(digest_size=16)
+    if algorithm == LEGACY_ALGORITHM:
+        return hashlib.md5()
+    raise ValueError(f"Unknown hash algorithm: {algorithm}")
+
+
+def is_unchanged(recorded, st) -> bool:
+    """
+    Cheap change check against a Database.load_file_index entry
+    (modified_time, size, mtime_ns, inode), without reading the file.
+
+    The key is (size, mtime_ns, inode); rows written before mtime_ns/inode were
+    recorded fall back to the float mtime. An inode of 0 means unknown (e.g.
+    os.scandir on Windows) and is not compared.
+    """
+    mtime, size, mtime_ns, inode = recorded
+    if size is not None and size != st.st_size:
+        return False
+    if mtime_ns is None:
+        return mtime == st.st_mtime
+    if inode and st.st_ino and inode != st.st_ino:
+        return False
+    return mtime_ns == st.st_mtime_ns
+
+
+class Fingerprinter:
+    """
+    Computes content fingerprints of image files as {algorithm: hexdigest}.
+
+    The first entry uses `algorithm` and is the one recorded for the file. Extra
+    algorithms (e.g. "md5" while a library still has rows hashed that way) are
+    computed from the same bytes, so moved files can still be matched against
+    older rows. In SAMPLED mode, files of at least sample_min_size are identified
+    by their size and three blocks only, under "<algorithm>+sampled"; extra
+    algorithms are skipped for them, since sampled and full hashes never match.
+    """
+
+    def __init__(self, algorithm: str = DEFAULT_ALGORITHM, mode: str = FULL, extra_algorithms=(),
+                 sample_min_size: int = SAMPLE_MIN_SIZE, sample_block: int = SAMPLE_BLOCK):
+        if mode not in (FULL, SAMPLED):
+            raise ValueError(f"Unknown hash mode: {mode}")
+        new_hasher(algorithm)  # Fails early on an unavailable algorithm
+        self.algorithm = algorithm
+        self.mode = mode
+        self.extra_algorithms = [a for a in dict.fromkeys(extra_algorithms) if a != algorithm]
+        self.sample_min_size = max(3 * sample_block, sample_min_size)
+        self.sample_block = sample_block
+
+    def samples(self, size: int) -> bool:
+        """True if a file of this size is fingerprinted from sampled blocks only."""
+        return self.mode == SAMPLED and size >= self.sample_min_size
+
+    def _sample_offsets(self, size: int):
+        return (0, (size - self.sample_block) // 2, size - self.sample_block)
+
+    def _digest(self, chunks, size: int, sampled: bool) -> dict:
+        if sampled:
+            hasher = new_hasher(self.algorithm)
+            hasher.update(size.to_bytes(8, "little"))
+            for chunk in chunks:
+                hasher.update(chunk)
+            return {self.algorithm + SAMPLED_SUFFIX: hasher.hexdigest()}
+
+        hashers = {algorithm: new_hasher(algorithm) for algorithm in [self.algorithm, *self.extra_algorithms]}
+        for chunk in chunks:
+            for hasher in hashers.values():
+                hasher.update(chunk)
+        return {algorithm: hasher.hexdigest() for algorithm, hasher in hashers.items()}
+
+    def fingerprint_bytes(self, data) -> dict:
+        """Fingerprints of a file already read into memory (bytes, memoryview or mmap)."""
+        view = memoryview(data)
+        size = len(view)
+        if self.samples(size):
+            chunks = [view[offset:offset + self.sample_block] for offset in self._sample_offsets(size)]
+            return self._digest(chunks, size, sampled=True)
+        return self._digest([view], size, sampled=False)
+
+    def fingerprint_file(self, path: str, size: int = None) -> dict:
+        """Fingerprints of a file on disk; sampled files are only partly read. Empty on read errors."""
+        try:
+            with open(path, "rb") as f:
+                if size is None:
+                    size = f.seek(0, 2)
+                    f.seek(0)
+                if self.samples(size):
+                    def blocks():
+                        for offset in self._sample_offsets(size):
+                            f.seek(offset)
+                            yield f.read(self.sample_block)
+                    return self._digest(blocks(), size, sampled=True)
+                return self._digest(iter(lambda: f.read(READ_CHUNK), b""), size, sampled=False)
+        except OSError as e:
+            logger.error(f"Error reading file {path}: {e}")
+            return {}
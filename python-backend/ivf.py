@@ -0,0 +1,38 @@
+import logging
+import numpy as np
+
+try:
+    import faiss
+except ImportError:
+    # Callers check for faiss themselves and warn with what they fall back to
+    faiss = None
+
+logger = logging.getLogger("FaceFrameIVF")
+
+# Up to this many vectors an exact flat search is used; above it, IVF
+# (shared by clustering and similarity search)
+FLAT_INDEX_LIMIT = 50000
+# IVF lists = IVF_LISTS_FACTOR * sqrt(n)
+IVF_LISTS_FACTOR = 4
+# IVF lists probed per query; higher = closer to exact, slower
+IVF_NPROBE = 32
+# k-means training for IVF: sample points per list and iterations
+IVF_TRAIN_PER_LIST = 40
+IVF_TRAIN_ITERATIONS = 10
+
+
+def build_ivf_index(X, nprobe: int = IVF_NPROBE):
+    """
+    Trained, still empty inner-product IVF index for the (n, d) float32 vectors X.
+    Callers add the vectors themselves. Needs faiss.
+    """
+    n, d = X.shape
+    nlist = max(1, int(IVF_LISTS_FACTOR * np.sqrt(n)))
+    quantizer = faiss.IndexFlatIP(d)
+    index = faiss.IndexIVFFlat(quantizer, d, nlist, faiss.METRIC_INNER_PRODUCT)
+    rng = np.random.default_rng(0)
+    index.cp.niter = IVF_TRAIN_ITERATIONS
+    index.train(X[rng.choice(n, size=min(n, nlist * IVF_TRAIN_PER_LIST), replace=False)])
+    index.nprobe = nprobe
+    logger.info(f"Trained IVF index with {nlist} lists on {n} vectors (nprobe={nprobe}).")
+    return index
@@ -0,0 +1,202 @@
+import time
+import logging
+import itertools
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("FaceFrameJobs")
+
+# Minimum seconds between two progress messages of one job
+PROGRESS_INTERVAL = 0.1
+# Finished jobs kept for LIST_JOBS
+FINISHED_JOBS_KEPT = 50
+
+# Job states
+QUEUED = "queued"  # created when the command arrives, waiting for its library
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class Job:
+    """
+    One long operation (scan, clustering, index rebuild) with its own cancel token
+    and structured progress: phase, current/total, items per second and ETA.
+
+    Progress is sent through `reply` as "progress" messages at most every
+    PROGRESS_INTERVAL seconds; phase changes and final updates are always sent.
+    Queued jobs can be cancelled before they start.
+    """
+
+    def __init__(self, job_id: str, job_type: str, path: str = None, reply=None, state: str = RUNNING):
+        self.id = job_id
+        self.type = job_type
+        self.path = path
+        self.reply = reply
+        self.state = state
+        self.phase = None
+        self.current = 0
+        self.total = None
+        self.message = None
+        self.started_at = time.time()
+        self.finished_at = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._phase_started = time.monotonic()
+        self._phase_start_count = 0
+        self._last_emit = 0.0
+
+    # Cancellation
+
+    def cancel(self):
+        self._cancel.set()
+
+    def is_cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    # Progress
+
+    def set_phase(self, phase: str, total=None):
+        """Starts a new phase; its rate and ETA are measured from here."""
+        with self._lock:
+            self.phase = phase
+            self.total = total
+            self.current = 0
+            self._phase_started = time.monotonic()
+            self._phase_start_count = 0
+        self.report(force=True)
+
+    def update(self, current=None, total=None, force: bool = False, **extra):
+        """Records progress within the current phase and emits it if due."""
+        with self._lock:
+            if current is not None:
+                self.current = current
+            if total is not None:
+                self.total = total
+        self.report(force=force, **extra)
+
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self._phase_started
+        done = self.current - self._phase_start_count
+        return done / elapsed if elapsed > 0 and done > 0 else 0.0
+
+    def eta(self):
+        rate = self.rate()
+        if not self.total or rate <= 0:
+            return None
+        return max(0.0, (self.total - self.current) / rate)
+
+    def report(self, force: bool = False, **extra):
+        if self.reply is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_emit < PROGRESS_INTERVAL:
+                return
+            self._last_emit = now
+        eta = self.eta()
+        self.reply({
+            "status": "progress",
+            "job_id": self.id,
+            "job_type": self.type,
+            "phase": self.phase,
+            "current": self.current,
+            "total": self.total,
+            "rate": round(self.rate(), 1),
+            "eta": None if eta is None else round(eta, 1),
+            **extra
+        })
+
+    def finish(self, state: str, message: str = None):
+        self.state = state
+        self.message = message
+        self.finished_at = time.time()
+
+    def to_dict(self) -> dict:
+        eta = self.eta() if self.state == RUNNING else None
+        return {
+            "job_id": self.id,
+            "job_type": self.type,
+            "path": self.path,
+            "state": self.state,
+            "phase": self.phase,
+            "current": self.current,
+            "total": self.total,
+            "rate": round(self.rate(), 1) if self.state == RUNNING else None,
+            "eta": None if eta is None else round(eta, 1),
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "message": self.message,
+        }
+
+
+class JobManager:
+    """Registry of running and recently finished jobs."""
+
+    def __init__(self, keep_finished: int = FINISHED_JOBS_KEPT):
+        self.keep_finished = keep_finished
+        self._jobs = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def create(self, job_type: str, path: str = None, reply=None, queued: bool = False) -> Job:
+        """Registers a job; queued jobs are listed and cancellable but only run after start()."""
+        with self._lock:
+            job = Job(f"job-{next(self._ids)}", job_type, path, reply, QUEUED if queued else RUNNING)
+            self._jobs[job.id] = job
+            self._prune()
+        logger.info(f"{'Queued' if queued else 'Started'} {job_type} job {job.id}" + (f" for {path}" if path else ""))
+        return job
+
+    def start(self, job: Job) -> bool:
+        """Moves a queued job to running. False (and the job ends as cancelled) if it was cancelled meanwhile."""
+        with self._lock:
+            if job.is_cancelled():
+                job.finish(CANCELLED)
+                return False
+            job.state = RUNNING
+            job.started_at = time.time()
+        logger.info(f"Started {job.type} job {job.id}" + (f" for {job.path}" if job.path else ""))
+        return True
+
+    def run(self, job: Job, fn):
+        """
+        Runs fn(job) and records how the job ended: cancelled if its token was set,
+        failed if fn raised (the exception is re-raised), completed otherwise.
+        """
+        try:
+            result = fn(job)
+        except Exception as e:
+            job.finish(FAILED, str(e))
+            raise
+        job.finish(CANCELLED if job.is_cancelled() else COMPLETED)
+        return result
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str = None, job_type: str = None) -> list:
+        """Cancels one job by id, or every running job (of job_type, if given). Returns the ids."""
+        with self._lock:
+            if job_id is not None:
+                targets = [self._jobs[job_id]] if job_id in self._jobs else []
+            else:
+                targets = [job for job in self._jobs.values() if job_type in (None, job.type)]
+        cancelled = []
+        for job in targets:
+            if job.state in (QUEUED, RUNNING):
+                job.cancel()
+                cancelled.append(job.id)
+        return cancelled
+
+    def list(self) -> list:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job.to_dict() for job in jobs]
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.state not in (QUEUED, RUNNING)]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
@@ -1,5 +1,7 @@
 import sys
 import json
+import time
+import argparse
 import logging
 import threading
 import os
@@ -18,202 +20,468 @@ logging.basicConfig(
 )
 logger = logging.getLogger("FaceFrameBackend")
 
-import database
-import scanner
-import processor
-from database import Database
-from scanner import Scanner
-from processor import FaceProcessor
-
-# Global State
-processor_instance = None
-scanner_instance = None
-
-# Global Abort Flag
-abort_scan_flag = False
-
-def run_scan(path, provider_name="CPUExecutionProvider"):
-    global processor_instance, scanner_instance, abort_scan_flag
-    
-    # Reset abort flag
-    abort_scan_flag = False
-    
+# Heavy modules (numpy, cv2, insightface, onnxruntime, scikit-learn) are imported
+# by the first command that needs them, so the command loop starts immediately.
+from session import SessionRegistry, library_key
+from dispatcher import Dispatcher, emit, INLINE, QUERY, WRITE, EDIT
+from jobs import JobManager
+
+# Scans, clustering runs and index rebuilds, each with its own cancel token
+jobs = JobManager()
+
+# Open library sessions (database, caches, similarity index) keyed by path
+sessions = SessionRegistry()
+
+# SCAN command keys forwarded to the Scanner pipeline
+PIPELINE_OPTIONS = ('read_workers', 'decode_workers', 'queue_size', 'decoded_queue_size', 'buffered_queue_size',
+                    'write_batch_size', 'infer_batch_size', 'discovery_buffer', 'processes', 'intra_op_threads')
+
+def run_scan(job, path, provider_name="CPUExecutionProvider", pipeline_options=None, model_options=None,
+             reply=emit):
+    processor_instance = None
+
     try:
         # Create directories
         faceframe_dir = Path(path) / ".faceframe"
         faceframe_dir.mkdir(parents=True, exist_ok=True)
-        
+
         thumbnail_dir = faceframe_dir / "thumbnails"
         thumbnail_dir.mkdir(parents=True, exist_ok=True)
-        
-        db_path = faceframe_dir / "index.db"
-        
-        # HACK: If provider is CUDA, use_gpu=True. Else False.
-        use_gpu = 'CUDA' in provider_name
-        processor_instance = FaceProcessor(use_gpu=use_gpu, thumbnail_dir=str(thumbnail_dir))
-
-        scanner_instance = Scanner(str(db_path), processor_instance)
-        
-        def on_progress(current, total, filename):
-             print(json.dumps({
-                "status": "progress", 
-                "current": current, 
-                "total": total, 
-                "file": filename
-            }), flush=True)
-
-        print(json.dumps({"status": "started", "path": path}), flush=True)
-        
-        scanner_instance.scan_directory(path, progress_callback=on_progress, abort_check=lambda: abort_scan_flag)
-        
-        if abort_scan_flag:
-            print(json.dumps({"status": "cancelled", "message": "Scan cancelled by user."}), flush=True)
-        else:
-            print(json.dumps({"status": "complete", "path": path}), flush=True)
-        
+
+        with sessions.use(path) as session:
+            # HACK: If provider is CUDA, use_gpu=True. Else False.
+            use_gpu = 'CUDA' in provider_name
+            options = dict(pipeline_options or {})
+            processor_options = {
+                "use_gpu": use_gpu,
+                "thumbnail_dir": str(thumbnail_dir),
+                "intra_op_threads": options.pop("intra_op_threads", None),
+                **(model_options or {}),
+            }
+
+            from scanner import Scanner
+            from processor import FaceProcessor
+            if options.get("processes", 0) <= 1:
+                # Worker processes load their own models; in-process scans reuse cached ones
+                processor_instance = FaceProcessor(**processor_options)
+
+            scanner_instance = Scanner(session.db_path, processor_instance, processor_options=processor_options,
+                                       db=session.db, vector_store=session.vector_store, **options)
+
+            def on_progress(report):
+                # Already rate-limited by the scanner's progress aggregator
+                report = dict(report)
+                job.update(report.pop("current"), report.pop("total"), force=True, **report)
+
+            reply({"status": "started", "path": path, "job_id": job.id})
+            job.set_phase("scanning")
+
+            scanner_instance.scan_directory(path, progress_callback=on_progress, abort_check=job.is_cancelled)
+
+            if job.is_cancelled():
+                reply({"status": "cancelled", "message": "Scan cancelled by user.", "job_id": job.id})
+            else:
+                reply({"status": "complete", "path": path, "job_id": job.id})
+
     except Exception as e:
         logger.error(f"Scan error: {e}")
-        print(json.dumps({"status": "error", "message": str(e)}), flush=True)
+        reply({"status": "error", "message": str(e), "job_id": job.id})
+        raise
+    finally:
+        if processor_instance is not None:
+            processor_instance.close()
+
+def run_warmup(provider_name="CPUExecutionProvider", model_options=None, reply=emit):
+    """
+    Loads the models into the model cache and runs them once, so the next scan
+    starts at full speed. Progress is reported as "warmup" messages.
+    """
+    start = time.perf_counter()
+
+    def report(phase):
+        reply({"status": "warmup", "phase": phase, "elapsed": round(time.perf_counter() - start, 2)})
+
+    warm_processor = None
+    try:
+        report("loading")
+        from processor import FaceProcessor
+        warm_processor = FaceProcessor(use_gpu='CUDA' in provider_name, **(model_options or {}))
+        warm_processor.warm_up(progress_callback=report)
+        reply({"status": "warmup_complete", "provider": provider_name,
+               "seconds": round(time.perf_counter() - start, 2)})
+    except Exception as e:
+        logger.error(f"Warm-up error: {e}")
+        reply({"status": "warmup_error", "message": str(e)})
+    finally:
+        # Models stay cached (subject to the idle timeout) for the next scan
+        if warm_processor is not None:
+            warm_processor.close()
+
+def start_warmup(provider_name="CPUExecutionProvider", model_options=None, reply=emit):
+    threading.Thread(target=run_warmup, args=(provider_name, model_options, reply), name="Warmup",
+                     daemon=True).start()
+
+def get_model_options(cmd):
+    """Model selection keys of a command (det_size, model_pack) as FaceProcessor arguments."""
+    options = {}
+    if cmd.get('det_size') is not None:
+        size = int(cmd['det_size'])
+        options['det_size'] = (size, size)
+    if cmd.get('model_pack'):
+        options['model_pack'] = str(cmd['model_pack'])
+    return options
+
+# Command handlers: handler(cmd, reply), registered with their kind in build_dispatcher()
+
+def queue_job(job_type):
+    """
+    prepare hook of job commands: creates the job as queued when the command arrives,
+    so it is listed and can be cancelled while it waits behind other writes.
+    """
+    def prepare(cmd, reply):
+        if not cmd.get('path'):
+            return cmd
+        job = jobs.create(job_type, cmd['path'], reply, queued=True)
+        reply({"status": "queued", "job_id": job.id, "job_type": job.type, "path": cmd['path']})
+        return {**cmd, "job": job}
+    return prepare
+
+def start_job(cmd, reply):
+    """Starts the command's queued job; None (after replying "cancelled") if it was cancelled while queued."""
+    job = cmd['job']
+    if jobs.start(job):
+        return job
+    reply({"status": "cancelled", "message": "Cancelled before it started.", "job_id": job.id, "job_type": job.type})
+    return None
+
+def handle_scan(cmd, reply):
+    path = cmd.get('path')
+    provider = cmd.get('provider', 'CPUExecutionProvider')
+    pipeline_options = {k: int(cmd[k]) for k in PIPELINE_OPTIONS if cmd.get(k) is not None}
+    if cmd.get('hash_mode'):
+        # "full" (default) or "sampled": very large files are fingerprinted from three blocks
+        pipeline_options['hash_mode'] = str(cmd['hash_mode'])
+    if path:
+        job = start_job(cmd, reply)
+        if job is None:
+            return
+        try:
+            jobs.run(job, lambda job: run_scan(job, path, provider, pipeline_options, get_model_options(cmd), reply))
+        except Exception:
+            pass  # Already reported as a scan error
+
+def handle_get_providers(cmd, reply):
+    from providers import get_available_providers, get_gpu_info
+    providers = get_available_providers()
+
+    # Also get GPU info for friendlier display
+    gpu_info = get_gpu_info()
+
+    reply({
+        "status": "providers",
+        "providers": providers,
+        "gpu_info": gpu_info
+    })
+
+def handle_cluster(cmd, reply):
+    path = cmd.get('path')
+    if path:
+        job = start_job(cmd, reply)
+        if job is None:
+            return
+        options = {
+            "incremental": cmd.get('incremental', True),
+            "engine": cmd.get('engine', 'auto'),
+        }
+        if cmd.get('assign_similarity') is not None:
+            options["assign_similarity"] = float(cmd['assign_similarity'])
+
+        def on_progress(phase, current, total):
+            if phase != job.phase:
+                job.set_phase(phase, total)
+            job.update(current, total)
+
+        def cluster(job):
+            from clusterer import Clusterer
+            with sessions.use(path) as session:
+                clusterer = Clusterer(session.db_path, db=session.db, vector_store=session.vector_store)
+                return clusterer.run_clustering(progress_callback=on_progress, abort_check=job.is_cancelled, **options)
+
+        count = jobs.run(job, cluster)
+        if job.is_cancelled():
+            reply({"status": "cancelled", "message": "Clustering cancelled by user.", "job_id": job.id,
+                   "job_type": job.type})
+        else:
+            reply({"status": "clustered", "count": count, "job_id": job.id})
+
+def handle_rebuild_index(cmd, reply):
+    """Rebuilds the vector store (embeddings.vec) of a library from its database."""
+    path = cmd.get('path')
+    if path:
+        job = start_job(cmd, reply)
+        if job is None:
+            return
+
+        def rebuild(job):
+            with sessions.use(path) as session:
+                job.set_phase("rebuilding", session.db.get_face_count())
+                session.vector_store.reset()
+                return session.vector_store.sync(session.db, progress_callback=job.update, abort_check=job.is_cancelled)
+
+        count = jobs.run(job, rebuild)
+        job.update(force=True)
+        reply({"status": "cancelled" if job.is_cancelled() else "index_rebuilt", "count": count,
+               "job_id": job.id, "job_type": job.type})
+
+def face_to_dict(f):
+    """(id, file_path, bbox, thumbnail_path[, det_score]) row -> response dict."""
+    face_data = {
+        "id": f[0],
+        "file_path": f[1],
+        "bbox": json.loads(f[2]) if f[2] else [0,0,0,0]
+    }
+    # Check for thumbnail (if stored in DB)
+    if len(f) > 3 and f[3]:
+        face_data["thumbnail"] = f[3]
+    if len(f) > 4:
+        face_data["det_score"] = f[4]
+    return face_data
+
+def person_to_dict(p):
+    """Database.get_persons row -> response dict."""
+    return {
+        "id": p[0],
+        "name": p[1] or f"Person {p[0]}",
+        "thumbnail": p[2],
+        "face_count": p[4],
+        "photo_count": p[5],
+        "first_seen": p[6],
+        "last_seen": p[7]
+    }
+
+# Rows per message when a list is streamed
+STREAM_CHUNK_SIZE = 1000
+
+def get_page_options(cmd):
+    """Pagination keys of a command: limit, cursor (from a previous next_cursor), offset, sort."""
+    options = {"limit": int(cmd['limit'])}
+    if options["limit"] < 1:
+        raise ValueError(f"limit must be at least 1, got {options['limit']}")
+    if cmd.get('cursor') is not None:
+        options["cursor"] = tuple(cmd['cursor'])
+    if cmd.get('offset') is not None:
+        options["offset"] = int(cmd['offset'])
+    if cmd.get('sort'):
+        options["sort"] = cmd['sort']
+    return options
+
+def reply_list(cmd, reply, status, fetch_page, to_dict, fetch_all, cache=None):
+    """
+    Answers a list query in one of three ways:
+      stream=true: every row, as "<status>_chunk" messages of chunk_size rows followed
+                   by "<status>_end" (pages are read with keyset pagination)
+      limit=N:     one "<status>" page with next_cursor to request the following page
+      otherwise:   the whole list in one "<status>" message
+    """
+    if cmd.get('stream'):
+        chunk_size = int(cmd.get('chunk_size') or STREAM_CHUNK_SIZE)
+        options = {k: v for k, v in get_page_options({**cmd, "limit": chunk_size}).items() if k != "cursor"}
+        sent, cursor = 0, None
+        while True:
+            rows, cursor = fetch_page(cursor=cursor, **options)
+            options.pop("offset", None)
+            if rows:
+                reply({"status": f"{status}_chunk", "offset": sent, "data": [to_dict(r) for r in rows]})
+                sent += len(rows)
+            if cursor is None:
+                break
+        reply({"status": f"{status}_end", "total": sent})
+    elif cmd.get('limit') is not None:
+        options = get_page_options(cmd)
+        key = (status, tuple(sorted(options.items())))
+        load = lambda: fetch_page(**options)
+        rows, next_cursor = cache(key, load) if cache else load()
+        reply({"status": status, "data": [to_dict(r) for r in rows], "next_cursor": next_cursor})
+    else:
+        reply({"status": status, "data": [to_dict(r) for r in fetch_all()]})
+
+def handle_get_unclustered(cmd, reply):
+    path = cmd.get('path')
+    if path:
+        with sessions.use(path) as session:
+            # Filters are applied in SQL
+            filters = {k: cmd[k] for k in ('file_path', 'folder', 'min_det_score') if cmd.get(k) is not None}
+
+            def fetch_page(**options):
+                return session.db.get_unclustered_faces_page(**options, **filters)
+
+            def fetch_all():
+                if not filters:
+                    return session.get_unclustered_faces_info()
+                rows, cursor = [], None
+                while True:
+                    page, cursor = fetch_page(limit=STREAM_CHUNK_SIZE, cursor=cursor)
+                    rows.extend(page)
+                    if cursor is None:
+                        return rows
+
+            reply_list(cmd, reply, "unclustered", fetch_page, face_to_dict, fetch_all,
+                       cache=lambda key, load: session.cached(key + tuple(sorted(filters.items())), load))
+
+def handle_find_similar(cmd, reply):
+    path = cmd.get('path')
+    face_id = cmd.get('face_id')
+    person_id = cmd.get('person_id')
+    if path and (face_id is not None or person_id is not None):
+        # Unknown ids raise ValueError, reported by the dispatcher as a request_error
+        with sessions.use(path) as session:
+            results = session.similarity.find_similar(
+                face_id=int(face_id) if face_id is not None else None,
+                person_id=int(person_id) if person_id is not None else None,
+                k=int(cmd.get('k', 20)),
+                include_same_person=bool(cmd.get('include_same_person', False))
+            )
+        reply({"status": "similar_faces", "face_id": face_id, "person_id": person_id, "data": results})
+
+def handle_cancel_scan(cmd, reply):
+    # Cancels the given job, or every queued or running scan
+    cancelled = jobs.cancel(job_id=cmd.get('job_id'), job_type=None if cmd.get('job_id') else "scan")
+    logger.info(f"Cancel signal received ({', '.join(cancelled) or 'no running job'}).")
+
+def handle_cancel_job(cmd, reply):
+    job_id = cmd.get('job_id')
+    if job_id:
+        reply({"status": "job_cancelling", "job_ids": jobs.cancel(job_id=job_id)})
+
+def handle_list_jobs(cmd, reply):
+    reply({"status": "jobs", "jobs": jobs.list()})
+
+def handle_clear_index(cmd, reply):
+    path = cmd.get('path')
+    if path:
+        import shutil
+        folder = Path(path) / ".faceframe"
+        # Waits for queries still using the library; new ones wait until the index is gone
+        with sessions.closed(path):
+            if folder.exists():
+                shutil.rmtree(folder)
+        reply({"status": "index_cleared"})
+
+def handle_get_persons(cmd, reply):
+    path = cmd.get('path')
+    if path:
+        with sessions.use(path) as session:
+            # [(id, name, thumb, date, face_count, photo_count, first_seen, last_seen), ...]
+            reply_list(cmd, reply, "persons", session.db.get_persons_page, person_to_dict, session.get_persons,
+                       cache=session.cached)
+
+def handle_get_photos_by_person(cmd, reply):
+    # Get all file_paths containing a specific person
+    path = cmd.get('path')
+    person_id = cmd.get('person_id')
+    if path and person_id:
+        with sessions.use(path) as session:
+            photos = session.get_photos_by_person(person_id)
+        reply({"status": "photos_by_person", "person_id": person_id, "photos": photos})
+
+def handle_rename_person(cmd, reply):
+    path = cmd.get('path')
+    person_id = cmd.get('person_id')
+    new_name = cmd.get('new_name')
+    if path and person_id and new_name:
+        with sessions.use(path) as session:
+            session.rename_person(person_id, new_name)
+        reply({"status": "person_renamed", "person_id": person_id, "new_name": new_name})
+
+def handle_merge_persons(cmd, reply):
+    path = cmd.get('path')
+    keep_id = cmd.get('keep_id')
+    merge_id = cmd.get('merge_id')
+    if path and keep_id and merge_id:
+        with sessions.use(path) as session:
+            session.merge_persons(keep_id, merge_id)
+        reply({"status": "persons_merged", "keep_id": keep_id, "merge_id": merge_id})
+
+def handle_warmup(cmd, reply):
+    start_warmup(cmd.get('provider', 'CPUExecutionProvider'), get_model_options(cmd), reply)
+
+def handle_unload_models(cmd, reply):
+    # Nothing can be loaded if the processor module was never imported
+    processor = sys.modules.get('processor')
+    count = processor.model_cache.unload() if processor else 0
+    reply({
+        "status": "models_unloaded",
+        "count": count,
+        "loaded": processor.model_cache.loaded() if processor else []
+    })
+
+def handle_ping(cmd, reply):
+    reply({"status": "pong"})
+
+def build_dispatcher():
+    """
+    Read-only queries run concurrently on the query pool; anything that modifies a
+    library (scan, cluster, edits, clearing the index) is serialized per library.
+    Queries wait for the edits sent before them, but not for scans or clustering.
+    """
+    dispatcher = Dispatcher(library_key=library_key)
+    dispatcher.register('SCAN', handle_scan, WRITE, prepare=queue_job("scan"))
+    dispatcher.register('CLUSTER', handle_cluster, WRITE, prepare=queue_job("cluster"))
+    dispatcher.register('RENAME_PERSON', handle_rename_person, EDIT)
+    dispatcher.register('MERGE_PERSONS', handle_merge_persons, EDIT)
+    dispatcher.register('CLEAR_INDEX', handle_clear_index, EDIT)
+    dispatcher.register('REBUILD_INDEX', handle_rebuild_index, WRITE, prepare=queue_job("rebuild"))
+    dispatcher.register('GET_PROVIDERS', handle_get_providers, QUERY)
+    dispatcher.register('GET_UNCLUSTERED', handle_get_unclustered, QUERY)
+    dispatcher.register('GET_PERSONS', handle_get_persons, QUERY)
+    dispatcher.register('GET_PHOTOS_BY_PERSON', handle_get_photos_by_person, QUERY)
+    dispatcher.register('FIND_SIMILAR', handle_find_similar, QUERY)
+    dispatcher.register('CANCEL_SCAN', handle_cancel_scan, INLINE)
+    dispatcher.register('CANCEL_JOB', handle_cancel_job, INLINE)
+    dispatcher.register('LIST_JOBS', handle_list_jobs, INLINE)
+    dispatcher.register('WARMUP', handle_warmup, INLINE)
+    dispatcher.register('UNLOAD_MODELS', handle_unload_models, INLINE)
+    dispatcher.register('PING', handle_ping, INLINE)
+    return dispatcher
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="FaceFrame Python backend (JSON commands on stdin)")
+    parser.add_argument("--warmup", action="store_true",
+                        help="load and pre-run the face models in the background at startup")
+    parser.add_argument("--provider", default="CPUExecutionProvider",
+                        help="execution provider used by --warmup")
+    return parser.parse_args(argv)
 
 def main():
+    args = parse_args()
     logger.info("FaceFrame Python Backend Started")
-    
+    dispatcher = build_dispatcher()
+    if args.warmup:
+        start_warmup(args.provider)
+
     while True:
         try:
             line = sys.stdin.readline()
             if not line:
                 break
-            
+
             command_str = line.strip()
             if not command_str:
                 continue
 
             try:
-                cmd = json.loads(command_str)
-                action = cmd.get('action')
-                
-                if action == 'SCAN':
-                    path = cmd.get('path')
-                    provider = cmd.get('provider', 'CPUExecutionProvider')
-                    if path:
-                        t = threading.Thread(target=run_scan, args=(path, provider))
-                        t.start()
-                
-                elif action == 'GET_PROVIDERS':
-                    import onnxruntime
-                    providers = onnxruntime.get_available_providers()
-                    
-                    # Also get GPU info for friendlier display
-                    gpu_info = FaceProcessor.get_gpu_info()
-                    
-                    print(json.dumps({
-                        "status": "providers", 
-                        "providers": providers,
-                        "gpu_info": gpu_info
-                    }), flush=True)
-
-                elif action == 'CLUSTER':
-                    path = cmd.get('path')
-                    if path:
-                        from clusterer import Clusterer
-                        db_path = Path(path) / ".faceframe" / "index.db"
-                        
-                        clusterer = Clusterer(str(db_path))
-                        count = clusterer.run_clustering()
-                        print(json.dumps({"status": "clustered", "count": count}), flush=True)
-
-                elif action == 'GET_UNCLUSTERED':
-                    path = cmd.get('path')
-                    if path:
-                        db_path = Path(path) / ".faceframe" / "index.db"
-                        db = Database(str(db_path))
-                        faces = db.get_unclustered_faces_info()
-                        # Convert to list of dicts - now includes thumbnail path
-                        data = []
-                        for f in faces:
-                            face_data = {
-                                "id": f[0], 
-                                "file_path": f[1], 
-                                "bbox": json.loads(f[2]) if f[2] else [0,0,0,0]
-                            }
-                            # Check for thumbnail (if stored in DB)
-                            if len(f) > 3 and f[3]:
-                                face_data["thumbnail"] = f[3]
-                            data.append(face_data)
-                        print(json.dumps({"status": "unclustered", "data": data}), flush=True)
-
-                elif action == 'CANCEL_SCAN':
-                    global abort_scan_flag
-                    abort_scan_flag = True
-                    logger.info("Cancel signal received.") 
-
-                elif action == 'CLEAR_INDEX':
-                    path = cmd.get('path')
-                    if path:
-                        import shutil
-                        folder = Path(path) / ".faceframe"
-                        if folder.exists():
-                            shutil.rmtree(folder)
-                        print(json.dumps({"status": "index_cleared"}), flush=True)
-
-                elif action == 'GET_PERSONS':
-                    path = cmd.get('path')
-                    if path:
-                        db_path = Path(path) / ".faceframe" / "index.db"
-                        db = Database(str(db_path))
-                        persons = db.get_persons() # [(id, name, thumb, date), ...]
-                        # Also get face count per person
-                        data = []
-                        for p in persons:
-                            person_data = {
-                                "id": p[0], 
-                                "name": p[1] or f"Person {p[0]}", 
-                                "thumbnail": p[2]
-                            }
-                            # Get count of faces for this person
-                            data.append(person_data)
-                        print(json.dumps({"status": "persons", "data": data}), flush=True)
-                
-                elif action == 'GET_PHOTOS_BY_PERSON':
-                    # Get all file_paths containing a specific person
-                    path = cmd.get('path')
-                    person_id = cmd.get('person_id')
-                    if path and person_id:
-                        db_path = Path(path) / ".faceframe" / "index.db"
-                        db = Database(str(db_path))
-                        photos = db.get_photos_by_person(person_id)
-                        print(json.dumps({"status": "photos_by_person", "person_id": person_id, "photos": photos}), flush=True)
-
-                elif action == 'RENAME_PERSON':
-                    path = cmd.get('path')
-                    person_id = cmd.get('person_id')
-                    new_name = cmd.get('new_name')
-                    if path and person_id and new_name:
-                        db_path = Path(path) / ".faceframe" / "index.db"
-                        db = Database(str(db_path))
-                        db.rename_person(person_id, new_name)
-                        print(json.dumps({"status": "person_renamed", "person_id": person_id, "new_name": new_name}), flush=True)
-
-                elif action == 'MERGE_PERSONS':
-                    path = cmd.get('path')
-                    keep_id = cmd.get('keep_id')
-                    merge_id = cmd.get('merge_id')
-                    if path and keep_id and merge_id:
-                        db_path = Path(path) / ".faceframe" / "index.db"
-                        db = Database(str(db_path))
-                        db.merge_persons(keep_id, merge_id)
-                        print(json.dumps({"status": "persons_merged", "keep_id": keep_id, "merge_id": merge_id}), flush=True)
-
-                elif action == 'PING':
-                    print(json.dumps({"status": "pong"}), flush=True)
-
+                dispatcher.dispatch(json.loads(command_str))
             except json.JSONDecodeError:
                 logger.error("Invalid JSON")
-                
+
         except KeyboardInterrupt:
             break
         except Exception as e:
             logger.error(f"Main loop error: {e}")
 
+    # Let running and queued jobs finish before closing the libraries
+    dispatcher.shutdown(wait=True)
+    sessions.close_all()
+
 if __name__ == "__main__":
     main()
@@ -1,21 +1,174 @@
+import gc
+import time
 import logging
+import threading
 import cv2
 import numpy as np
 import os
 from pathlib import Path
 import hashlib
+import providers
 
 try:
     import insightface
     from insightface.app import FaceAnalysis
+    from insightface.utils import face_align
+    from insightface.model_zoo.retinaface import distance2bbox, distance2kps
 except ImportError:
     logging.warning("InsightFace not installed yet")
     FaceAnalysis = None
 
 logger = logging.getLogger("FaceFrameProcessor")
 
+# Max aligned face crops per recognition forward pass
+RECOGNITION_BATCH_SIZE = 64
+
+# name='buffalo_l' is a good balance of speed/accuracy
+DEFAULT_MODEL_PACK = 'buffalo_l'
+# det_size=(640, 640) is default. Larger = better for small faces but slower.
+DEFAULT_DET_SIZE = (640, 640)
+
+# Loaded models nobody is using are unloaded after this many seconds (None = never)
+MODEL_IDLE_TIMEOUT = 600
+# How often the idle check runs
+MODEL_IDLE_CHECK_INTERVAL = 60
+
+
+class ModelCache:
+    """
+    Prepared FaceAnalysis instances shared across scans and libraries, keyed by
+    (providers, det_size, model pack, intra-op threads).
+
+    FaceProcessors acquire a model on creation and release it in close(). Models
+    that are not in use can be dropped with unload() (the UNLOAD_MODELS command)
+    and are dropped automatically after idle_timeout seconds without use.
+    """
+
+    def __init__(self, idle_timeout=MODEL_IDLE_TIMEOUT, check_interval=MODEL_IDLE_CHECK_INTERVAL):
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self._entries = {}  # key -> {'app' (None while loading), 'users', 'last_used', 'ready', 'error'}
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    def acquire(self, providers, det_size=DEFAULT_DET_SIZE, model_pack=DEFAULT_MODEL_PACK, intra_op_threads=None):
+        """Returns a prepared FaceAnalysis for the key, loading it on first use."""
+        key = (tuple(providers), tuple(det_size), model_pack, intra_op_threads or None)
+        with self._lock:
+            entry = self._entries.get(key)
+            loading = entry is None
+            if loading:
+                # Registered before loading so concurrent callers wait for this load
+                # instead of starting their own; counted as in use, so unload() skips it
+                entry = {'app': None, 'users': 0, 'last_used': time.monotonic(),
+                         'ready': threading.Event(), 'error': None}
+                self._entries[key] = entry
+            entry['users'] += 1
+
+        if loading:
+            # Loading takes seconds, so it runs outside the lock: unload() and loaded()
+            # (UNLOAD_MODELS is answered on the stdin thread) must not wait for it
+            try:
+                app = _load_face_analysis(*key)
+            except BaseException as e:
+                with self._lock:
+                    self._entries.pop(key, None)
+                entry['error'] = e
+                entry['ready'].set()
+                raise
+            with self._lock:
+                entry['app'] = app
+            entry['ready'].set()
+        else:
+            entry['ready'].wait()
+            if entry['error'] is not None:
+                raise RuntimeError(f"Loading {model_pack} models failed: {entry['error']}")
+            logger.info(f"Reusing loaded {model_pack} models ({', '.join(providers)}).")
+
+        with self._lock:
+            self._start_watcher()
+        return entry['app']
+
+    def release(self, app):
+        with self._lock:
+            for entry in self._entries.values():
+                if entry['app'] is app:
+                    entry['users'] = max(0, entry['users'] - 1)
+                    entry['last_used'] = time.monotonic()
+
+    def unload(self, idle_for: float = 0) -> int:
+        """
+        Drops models that are not in use and have been idle for at least idle_for
+        seconds. Returns how many were unloaded; models in use are kept.
+        """
+        now = time.monotonic()
+        with self._lock:
+            stale = [key for key, entry in self._entries.items()
+                     if entry['users'] == 0 and now - entry['last_used'] >= idle_for]
+            for key in stale:
+                del self._entries[key]
+        if stale:
+            gc.collect()
+            logger.info(f"Unloaded {len(stale)} model set(s).")
+        return len(stale)
+
+    def loaded(self) -> list:
+        """Describes the loaded model sets (for status reporting)."""
+        with self._lock:
+            return [{"providers": list(key[0]), "det_size": list(key[1]), "model_pack": key[2],
+                     "in_use": entry['users'], "loading": entry['app'] is None}
+                    for key, entry in self._entries.items()]
+
+    def _start_watcher(self):
+        if self.idle_timeout is None or (self._watcher is not None and self._watcher.is_alive()):
+            return
+        self._watcher = threading.Thread(target=self._watch_idle, name="ModelCacheIdle", daemon=True)
+        self._watcher.start()
+
+    def _watch_idle(self):
+        while True:
+            time.sleep(self.check_interval)
+            self.unload(idle_for=self.idle_timeout)
+            with self._lock:
+                if not self._entries:
+                    self._watcher = None
+                    return
+
+
+def _load_face_analysis(providers, det_size, model_pack, intra_op_threads):
+    # allowed_modules controls which models to load
+    app = FaceAnalysis(
+        name=model_pack,
+        providers=list(providers),
+        allowed_modules=['detection', 'recognition']  # Only load what we need
+    )
+    if intra_op_threads:
+        _set_intra_op_threads(app, list(providers), intra_op_threads)
+    app.prepare(ctx_id=0, det_size=det_size)
+    logger.info(f"Loaded {model_pack} models. Providers: {list(providers)}")
+    return app
+
+
+def _set_intra_op_threads(app, providers, intra_op_threads: int):
+    """
+    Recreates each model's ONNX session with a fixed intra-op thread count.
+    FaceAnalysis does not forward SessionOptions, so this is done after loading.
+    """
+    import onnxruntime
+    opts = onnxruntime.SessionOptions()
+    opts.intra_op_num_threads = intra_op_threads
+    opts.inter_op_num_threads = 1
+    for model in app.models.values():
+        model.session = onnxruntime.InferenceSession(model.model_file, sess_options=opts, providers=providers)
+
+
+# Process-wide model cache
+model_cache = ModelCache()
+
+
 class FaceProcessor:
-    def __init__(self, use_gpu=True, thumbnail_dir=None):
+    def __init__(self, use_gpu=True, thumbnail_dir=None, intra_op_threads=None,
+                 det_size=DEFAULT_DET_SIZE, model_pack=DEFAULT_MODEL_PACK, cache: ModelCache = None):
         if not FaceAnalysis:
             raise ImportError("InsightFace package is missing")
         
@@ -24,41 +177,212 @@ class FaceProcessor:
         # 'providers' argument controls execution provider (CUDA, CoreML, CPU)
         providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if use_gpu else ['CPUExecutionProvider']
         
-        # Initialize InsightFace model
-        # name='buffalo_l' is a good balance of speed/accuracy
-        # allowed_modules controls which models to load
-        self.app = FaceAnalysis(
-            name='buffalo_l', 
-            providers=providers,
-            allowed_modules=['detection', 'recognition']  # Only load what we need
-        )
-        # det_size=(640, 640) is default. Larger = better for small faces but slower.
-        self.app.prepare(ctx_id=0, det_size=(640, 640)) 
+        # Models are shared through the cache, so only the first processor pays for loading them
+        self._cache = cache or model_cache
+        self.app = self._cache.acquire(providers, det_size, model_pack, intra_op_threads)
         logger.info(f"FaceProcessor initialized. Providers: {providers}")
 
-    def process_image(self, image_path: str):
+    def warm_up(self, progress_callback=None):
         """
-        Detects faces in an image.
-        Returns a list of dicts with 'embedding', 'bbox', 'thumbnail_path'.
+        Runs detection and recognition once on synthetic input so ONNX Runtime
+        finishes graph optimization and memory allocation before the first real image.
+        progress_callback(phase) is called before each step.
         """
+        if progress_callback:
+            progress_callback("detection")
+        input_w, input_h = self.app.det_model.input_size
+        self.app.det_model.detect(np.zeros((input_h, input_w, 3), dtype=np.uint8), max_num=0, metric='default')
+
+        if progress_callback:
+            progress_callback("recognition")
+        rec_model = self.app.models['recognition']
+        size = rec_model.input_size[0]
+        rec_model.get_feat([np.zeros((size, size, 3), dtype=np.uint8)])
+
+    def close(self):
+        """Returns the models to the cache (they stay loaded until unloaded or idle)."""
+        if self.app is not None:
+            self._cache.release(self.app)
+            self.app = None
+
+    def load_image(self, image_path: str):
+        """Reads and decodes an image to a BGR array. Returns None on failure."""
         # Safe read for Windows paths
         try:
             with open(image_path, 'rb') as f:
-                file_bytes = np.frombuffer(f.read(), dtype=np.uint8)
-                img = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
+                data = f.read()
         except Exception as e:
             logger.error(f"Failed to read file {image_path}: {e}")
+            return None
+        return self.decode_image(data, image_path)
+
+    @staticmethod
+    def decode_image(data, image_path: str = None):
+        """
+        Decodes an encoded image (bytes, bytearray, memoryview or mmap) to a BGR array
+        without copying it. Returns None on failure; image_path is only used for logging.
+        """
+        try:
+            img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        except Exception as e:
+            logger.error(f"Failed to decode {image_path or 'image buffer'}: {e}")
+            return None
+        if img is None:
+            logger.error(f"Could not decode image: {image_path or 'image buffer'}")
+        return img
+
+    def process_image(self, image_path: str):
+        """
+        Detects faces in an image.
+        Returns a list of dicts with 'embedding', 'bbox', 'thumbnail_path'.
+        """
+        img = self.load_image(image_path)
+        if img is None:
             return []
+        return self.process_decoded(img, image_path)
 
+    def process_bytes(self, data, image_path: str):
+        """
+        Same as process_image() for a file already read into memory, so callers that
+        also hash the file read it only once. image_path names thumbnails.
+        """
+        img = self.decode_image(data, image_path)
         if img is None:
-            logger.error(f"Could not decode image: {image_path}")
             return []
+        return self.process_decoded(img, image_path)
+
+    def process_decoded(self, img, image_path: str):
+        """
+        Runs detection and recognition on an already decoded image.
+        image_path is only used to name thumbnails and for logging.
+        """
+        return self.process_decoded_batch([img], [image_path])[0]
+
+    # Entry point for callers holding a decoded BGR array (counterpart of process_bytes)
+    process_array = process_decoded
+
+    def process_batch(self, image_paths):
+        """
+        Detects faces in several images at once.
+        Returns one result list per path, in the same shape as process_image().
+        """
+        images = [self.load_image(path) for path in image_paths]
+        return self.process_decoded_batch(images, image_paths)
+
+    def process_decoded_batch(self, images, image_paths):
+        """
+        Batched counterpart of process_decoded(). Detection runs as one batch when the
+        detector supports it, and all aligned face crops across the batch go through
+        the recognition model together. Entries of `images` may be None (decode failures).
+        """
+        results = [[] for _ in images]
+        valid = [i for i, img in enumerate(images) if img is not None]
+        if not valid:
+            return results
+
+        detections = self._detect_batch([images[i] for i in valid])
+
+        # Gather every aligned crop across the batch for a single recognition pass
+        rec_model = self.app.models['recognition']
+        crops = []
+        for i, (bboxes, kpss) in zip(valid, detections):
+            for k in range(bboxes.shape[0]):
+                crops.append(face_align.norm_crop(images[i], landmark=kpss[k], image_size=rec_model.input_size[0]))
+
+        embeddings = np.empty((0, 0), dtype=np.float32)
+        if crops:
+            embeddings = np.concatenate([
+                rec_model.get_feat(crops[start:start + RECOGNITION_BATCH_SIZE])
+                for start in range(0, len(crops), RECOGNITION_BATCH_SIZE)
+            ]).astype(np.float32)
+
+        offset = 0
+        for i, (bboxes, _) in zip(valid, detections):
+            count = bboxes.shape[0]
+            results[i] = self._build_results(images[i], image_paths[i], bboxes, embeddings[offset:offset + count])
+            offset += count
+        return results
+
+    def _detect_batch(self, images):
+        """Returns [(bboxes (n, 5), kpss (n, 5, 2)), ...] per image."""
+        det_model = self.app.det_model
+        if len(images) == 1 or not self._detector_is_batched():
+            # The stock buffalo_l detector is exported with a fixed batch size of 1
+            return [det_model.detect(img, max_num=0, metric='default') for img in images]
+
+        # Letterbox every image to the detector input size (same placement as RetinaFace.detect)
+        input_w, input_h = det_model.input_size
+        det_imgs, det_scales = [], []
+        for img in images:
+            im_ratio = float(img.shape[0]) / img.shape[1]
+            if im_ratio > float(input_h) / input_w:
+                new_h, new_w = input_h, int(input_h / im_ratio)
+            else:
+                new_w, new_h = input_w, int(input_w * im_ratio)
+            det_img = np.zeros((input_h, input_w, 3), dtype=np.uint8)
+            det_img[:new_h, :new_w, :] = cv2.resize(img, (new_w, new_h))
+            det_imgs.append(det_img)
+            det_scales.append(float(new_h) / img.shape[0])
 
-        faces = self.app.get(img)
+        mean = det_model.input_mean
+        blob = cv2.dnn.blobFromImages(det_imgs, 1.0 / det_model.input_std, (input_w, input_h),
+                                      (mean, mean, mean), swapRB=True)
+        net_outs = det_model.session.run(det_model.output_names, {det_model.input_name: blob})
+
+        return [
+            self._decode_detections([out[b] for out in net_outs], input_h, input_w, det_scales[b])
+            for b in range(len(images))
+        ]
+
+    def _detector_is_batched(self) -> bool:
+        """True if the detection model has a dynamic batch dimension on its input and outputs."""
+        if getattr(self, '_batched_detector', None) is None:
+            det_model = self.app.det_model
+            batch_dim = det_model.input_shape[0]
+            outputs = det_model.session.get_outputs()
+            self._batched_detector = not isinstance(batch_dim, int) and len(outputs[0].shape) == 3
+        return self._batched_detector
+
+    def _decode_detections(self, net_outs, input_height, input_width, det_scale):
+        """Anchor decoding + NMS for one image's outputs, mirroring RetinaFace.forward/detect."""
+        det_model = self.app.det_model
+        fmc = det_model.fmc
+        scores_list, bboxes_list, kpss_list = [], [], []
+        for idx, stride in enumerate(det_model._feat_stride_fpn):
+            scores = net_outs[idx]
+            bbox_preds = net_outs[idx + fmc] * stride
+            kps_preds = net_outs[idx + fmc * 2] * stride
+            height, width = input_height // stride, input_width // stride
+
+            key = (height, width, stride)
+            anchor_centers = det_model.center_cache.get(key)
+            if anchor_centers is None:
+                anchor_centers = np.stack(np.mgrid[:height, :width][::-1], axis=-1).astype(np.float32)
+                anchor_centers = (anchor_centers * stride).reshape((-1, 2))
+                if det_model._num_anchors > 1:
+                    anchor_centers = np.stack([anchor_centers] * det_model._num_anchors, axis=1).reshape((-1, 2))
+                det_model.center_cache[key] = anchor_centers
+
+            pos_inds = np.where(scores >= det_model.det_thresh)[0]
+            scores_list.append(scores[pos_inds])
+            bboxes_list.append(distance2bbox(anchor_centers, bbox_preds)[pos_inds])
+            kpss = distance2kps(anchor_centers, kps_preds)
+            kpss_list.append(kpss.reshape((kpss.shape[0], -1, 2))[pos_inds])
+
+        scores = np.vstack(scores_list)
+        order = scores.ravel().argsort()[::-1]
+        bboxes = np.vstack(bboxes_list) / det_scale
+        kpss = np.vstack(kpss_list) / det_scale
+        pre_det = np.hstack((bboxes, scores)).astype(np.float32, copy=False)[order, :]
+        keep = det_model.nms(pre_det)
+        return pre_det[keep, :], kpss[order][keep]
+
+    def _build_results(self, img, image_path: str, bboxes, embeddings):
+        """Crops thumbnails and packs detections into the per-face result dicts."""
         results = []
         
-        for idx, face in enumerate(faces):
-            bbox = face.bbox.astype(int).tolist()
+        for idx in range(bboxes.shape[0]):
+            bbox = bboxes[idx, 0:4].astype(int).tolist()
             x1, y1, x2, y2 = bbox
             
             # Clamp to image bounds
@@ -84,9 +408,9 @@ class FaceProcessor:
                     thumbnail_path = None
             
             results.append({
-                'embedding': face.embedding.tolist(), 
+                'embedding': embeddings[idx],
                 'bbox': bbox,
-                'det_score': float(face.det_score),
+                'det_score': float(bboxes[idx, 4]),
                 'thumbnail': thumbnail_path
             })
             
@@ -98,26 +422,9 @@ class FaceProcessor:
     @staticmethod
     def get_available_providers():
         """Returns list of available ONNX Runtime providers."""
-        try:
-            import onnxruntime
-            return onnxruntime.get_available_providers()
-        except ImportError:
-            return ["CPUExecutionProvider"]
+        return providers.get_available_providers()
     
     @staticmethod
     def get_gpu_info():
         """Returns a dict with GPU name and CUDA availability."""
-        info = {
-            "cuda_available": False,
-            "gpu_name": None,
-            "cuda_version": None
-        }
-        try:
-            import torch
-            if torch.cuda.is_available():
-                info["cuda_available"] = True
-                info["gpu_name"] = torch.cuda.get_device_name(0)
-                info["cuda_version"] = torch.version.cuda
-        except ImportError:
-            pass
-        return info
+        return providers.get_gpu_info()
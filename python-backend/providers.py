@@ -0,0 +1,67 @@
+import re
+import sys
+import shutil
+import logging
+import subprocess
+from functools import lru_cache
+
+logger = logging.getLogger("FaceFrameProviders")
+
+# Seconds to wait for nvidia-smi before giving up on GPU details
+NVIDIA_SMI_TIMEOUT = 5
+
+
+def get_available_providers():
+    """Returns list of available ONNX Runtime providers."""
+    try:
+        import onnxruntime
+        return onnxruntime.get_available_providers()
+    except ImportError:
+        return ["CPUExecutionProvider"]
+
+
+@lru_cache(maxsize=1)
+def get_gpu_info():
+    """
+    Returns a dict with GPU name and CUDA availability.
+
+    Queried from nvidia-smi rather than by importing torch, which takes seconds;
+    torch is only consulted when something else already imported it. Cached,
+    since the hardware does not change while the backend runs.
+    """
+    info = {
+        "cuda_available": False,
+        "gpu_name": None,
+        "cuda_version": None
+    }
+
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        try:
+            if torch.cuda.is_available():
+                info["cuda_available"] = True
+                info["gpu_name"] = torch.cuda.get_device_name(0)
+                info["cuda_version"] = torch.version.cuda
+            return info
+        except Exception as e:
+            logger.warning(f"torch GPU query failed: {e}")
+
+    smi = shutil.which("nvidia-smi")
+    if smi is None:
+        return info
+    try:
+        output = subprocess.run([smi], capture_output=True, text=True, timeout=NVIDIA_SMI_TIMEOUT).stdout
+        names = subprocess.run([smi, "--query-gpu=name", "--format=csv,noheader"],
+                               capture_output=True, text=True, timeout=NVIDIA_SMI_TIMEOUT).stdout.splitlines()
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(f"nvidia-smi failed: {e}")
+        return info
+
+    names = [name.strip() for name in names if name.strip()]
+    if names:
+        info["cuda_available"] = True
+        info["gpu_name"] = names[0]
+        match = re.search(r"CUDA Version:\s*([\d.]+)", output)
+        if match:
+            info["cuda_version"] = match.group(1)
+    return info
@@ -1,84 +1,751 @@
 import os
-import hashlib
+import queue
+import time
 import logging
+import threading
+import multiprocessing
 from pathlib import Path
 from database import Database
+from vector_store import VectorStore
+from fingerprint import Fingerprinter, is_unchanged, new_hasher, DEFAULT_ALGORITHM, FULL, SAMPLED_SUFFIX
 
 logger = logging.getLogger("FaceFrameScanner")
 
 VALID_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tiff'}
 
+# Marks the end of a pipeline queue
+_DONE = object()
+
+# Folder holding the index itself (index.db, thumbnails); never scanned
+INDEX_DIR_NAME = ".faceframe"
+
+# Minimum seconds between two progress reports during a scan
+PROGRESS_INTERVAL = 0.1
+
+# Unchanged files per "seen" update handed to the writer
+SEEN_BATCH = 1000
+
+def iter_image_files(root_path: str, unreadable: list = None):
+    """
+    Yields (path, stat_result) for every image under root_path using os.scandir.
+    Directories are walked depth-first as they are read, so the first results
+    arrive immediately instead of after a full pre-walk. Directories that cannot
+    be listed are appended to `unreadable`, if given.
+    """
+    stack = [root_path]
+    while stack:
+        dir_path = stack.pop()
+        try:
+            with os.scandir(dir_path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name != INDEX_DIR_NAME:
+                                stack.append(entry.path)
+                        elif os.path.splitext(entry.name)[1].lower() in VALID_EXTENSIONS:
+                            # DirEntry.stat() is free on Windows and cached elsewhere
+                            yield entry.path, entry.stat()
+                    except OSError as e:
+                        logger.error(f"Cannot stat {entry.path}: {e}")
+        except OSError as e:
+            logger.error(f"Cannot read directory {dir_path}: {e}")
+            if unreadable is not None:
+                unreadable.append(dir_path)
+
+def _list_dir(path: str):
+    """Names in a directory, or None if it cannot be listed."""
+    try:
+        return os.listdir(path)
+    except OSError:
+        return None
+
+def _is_missing(path: str) -> bool:
+    """True only if the file is known to be gone; other stat errors (e.g. a share that stopped answering) are not."""
+    try:
+        os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return True
+    except OSError as e:
+        logger.warning(f"Cannot check {path}: {e}")
+    return False
+
+def _folder_unreachable(path: str, root_path: str, cache: dict) -> bool:
+    """
+    True if the folder of a missing file looks unreachable rather than deleted: the
+    folder is gone and its nearest existing ancestor under root_path cannot be listed
+    or is empty, as the mount point of a disconnected drive or share is.
+    """
+    folder = os.path.dirname(path)
+    if folder not in cache:
+        if os.path.isdir(folder):
+            cache[folder] = False
+        else:
+            ancestor = folder
+            while not os.path.isdir(ancestor) and len(ancestor) > len(root_path):
+                ancestor = os.path.dirname(ancestor)
+            cache[folder] = not _list_dir(ancestor)
+    return cache[folder]
+
+def _put_unless_stopped(q, item, stop, poll: float = 0.2) -> bool:
+    """Blocking put that gives up once `stop` is set. Returns True if the item was queued."""
+    while True:
+        try:
+            q.put(item, timeout=poll)
+            return True
+        except queue.Full:
+            if stop.is_set():
+                return False
+
+class ScanProgress:
+    """
+    Aggregates per-file scan events into progress reports emitted at a bounded rate.
+
+    Files are counted as skipped (unchanged), processed or errors, along with the
+    faces found; processed files whose faces were taken from an identical, already
+    indexed file (moved, renamed or duplicated) are also counted as reused. A ticker
+    thread hands the latest counts to callback(report) at most every `interval`
+    seconds, and only when something changed; finish() always delivers the final
+    report.
+    """
+
+    def __init__(self, callback, discovery, interval: float = PROGRESS_INTERVAL):
+        self.callback = callback
+        self.discovery = discovery
+        self.interval = interval
+        self.skipped = 0
+        self.processed = 0
+        self.errors = 0
+        self.faces = 0
+        self.reused = 0
+        # Files forgotten because they no longer exist (set at the end of the scan)
+        self.removed = 0
+        self.last_file = None
+        self._started = time.monotonic()
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._ticker = None
+
+    @property
+    def current(self) -> int:
+        return self.skipped + self.processed + self.errors
+
+    def skip(self, filename):
+        with self._lock:
+            self.skipped += 1
+            self.last_file = filename
+            self._dirty = True
+
+    def done(self, filename, faces: int = 0, error: bool = False, reused: bool = False):
+        with self._lock:
+            if error:
+                self.errors += 1
+            else:
+                self.processed += 1
+                self.reused += reused
+            self.faces += faces
+            self.last_file = filename
+            self._dirty = True
+
+    def report(self, final: bool = False) -> dict:
+        with self._lock:
+            self._dirty = False
+            elapsed = max(time.monotonic() - self._started, 1e-9)
+            return {
+                "current": self.current,
+                "total": self.discovery['found'],
+                "estimated_total": not self.discovery['done'],
+                "file": "Complete" if final else self.last_file,
+                "skipped": self.skipped,
+                "processed": self.processed,
+                "faces": self.faces,
+                "reused": self.reused,
+                "removed": self.removed,
+                "errors": self.errors,
+                "elapsed": round(elapsed, 2),
+                "files_per_sec": round(self.current / elapsed, 1),
+                "processed_per_sec": round((self.processed + self.errors) / elapsed, 1),
+                "faces_per_sec": round(self.faces / elapsed, 1),
+            }
+
+    def start(self):
+        if self.callback:
+            self._ticker = threading.Thread(target=self._tick, name="scan-progress", daemon=True)
+            self._ticker.start()
+
+    def _tick(self):
+        while not self._stop.wait(self.interval):
+            if self._dirty:
+                self.callback(self.report())
+
+    def finish(self) -> dict:
+        """Stops the ticker and delivers the final report."""
+        self._stop.set()
+        if self._ticker is not None:
+            self._ticker.join()
+        report = self.report(final=True)
+        if self.callback:
+            self.callback(report)
+        return report
+
+# Per-process state for multi-process scanning
+_worker_processor = None
+_worker_error = None
+_worker_db = None
+_worker_fingerprinter = None
+
+def _init_worker(processor_options, db_path, fingerprinter):
+    """Pool initializer: loads a private FaceProcessor (and ONNX sessions) in each worker process."""
+    global _worker_processor, _worker_error, _worker_db, _worker_fingerprinter
+    _worker_fingerprinter = fingerprinter
+    try:
+        from processor import FaceProcessor
+        _worker_processor = FaceProcessor(**processor_options)
+        # Read-only use: looking up hashes of already indexed files
+        _worker_db = Database(db_path)
+    except Exception as e:
+        # Raising here would make the pool respawn the worker forever
+        _worker_error = f"{type(e).__name__}: {e}"
+
+def _process_in_worker(item):
+    """Hashes and processes one file inside a worker process."""
+    if _worker_processor is None:
+        raise RuntimeError(f"Worker failed to initialize: {_worker_error}")
+    data = _read_and_fingerprint(item, _worker_fingerprinter, _worker_db)
+    if data is None:
+        return item
+    try:
+        img = _worker_processor.decode_image(data, item['path'])
+        del data
+        if img is None:
+            item['error'] = item['undecodable'] = True
+            return item
+        item['faces'] = _worker_processor.process_array(img, item['path'])
+    except Exception as e:
+        logger.error(f"Error processing faces for {item['path']}: {e}")
+        item['error'] = True
+    return item
+
+def read_file(path: str):
+    """Reads a whole file into memory. Returns None on failure."""
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError as e:
+        logger.error(f"Error reading file {path}: {e}")
+        return None
+
+def _read_and_fingerprint(item, fingerprinter, db):
+    """
+    Fingerprints the item's file (item['hashes'], {algorithm: digest}, the first one
+    is recorded) and checks whether an indexed file has the same content
+    (item['duplicate']). Returns the file contents for decoding, read from disk only
+    once for both; None if the file could not be read or its faces will be reused.
+    """
+    path = item['path']
+    if item.get('rehash'):
+        # Unchanged file recorded with an older algorithm: only its fingerprint is needed
+        item['hashes'] = fingerprinter.fingerprint_file(path, item['size'])
+        if not item['hashes']:
+            item['error'] = True
+        return None
+
+    data = None
+    if fingerprinter.samples(item['size']):
+        # Only three blocks are needed, so a duplicate of a huge file is never read in full
+        item['hashes'] = fingerprinter.fingerprint_file(path, item['size'])
+    else:
+        data = read_file(path)
+        item['hashes'] = fingerprinter.fingerprint_bytes(data) if data is not None else {}
+    if not item['hashes']:
+        item['error'] = True  # I/O errors are retried on the next scan
+        return None
+
+    item['duplicate'] = bool(_matching_paths(db, item))
+    if item['duplicate']:
+        return None
+    if data is None:
+        data = read_file(path)
+        if data is None:
+            item['error'] = True  # I/O errors are retried on the next scan
+    return data
+
+def _matching_paths(db, item) -> list:
+    """Indexed paths whose recorded hash equals one of the item's fingerprints."""
+    for algorithm, digest in item.get('hashes', {}).items():
+        paths = db.get_paths_by_hash(digest, algorithm)
+        if paths:
+            return paths
+    return []
+
 class Scanner:
-    def __init__(self, db_path: str, processor=None):
-        self.db = Database(db_path)
+    def __init__(self, db_path: str, processor=None, read_workers: int = 4, decode_workers: int = 2,
+                 queue_size: int = 64, decoded_queue_size: int = 8, write_batch_size: int = 32,
+                 infer_batch_size: int = 4, discovery_buffer: int = 10000,
+                 processes: int = 0, processor_options: dict = None, db: Database = None,
+                 vector_store: VectorStore = None, progress_interval: float = PROGRESS_INTERVAL,
+                 hash_mode: str = FULL, buffered_queue_size: int = 16):
+        self.db = db or Database(db_path)
         self.processor = processor
+        # Kept in step with the faces table as batches are committed
+        self.vector_store = vector_store or VectorStore.for_database(db_path)
 
-    def calculate_hash(self, file_path: str) -> str:
-        """Computes MD5 hash of the file (fast enough for images)."""
-        hash_md5 = hashlib.md5()
-        try:
-            with open(file_path, "rb") as f:
-                for chunk in iter(lambda: f.read(4096), b""):
-                    hash_md5.update(chunk)
-            return hash_md5.hexdigest()
-        except Exception as e:
-            logger.error(f"Error reading file {file_path}: {e}")
-            return ""
+        # Pipeline tuning (see scan_directory)
+        self.read_workers = max(1, read_workers)
+        self.decode_workers = max(1, decode_workers)
+        self.queue_size = max(1, queue_size)
+        # Decoded images are large, so their queue is kept short
+        self.decoded_queue_size = max(1, decoded_queue_size)
+        # Files read into memory ahead of decoding (whole encoded files)
+        self.buffered_queue_size = max(1, buffered_queue_size)
+        self.write_batch_size = max(1, write_batch_size)
+        # Discovered paths buffered ahead of the pipeline
+        self.discovery_buffer = max(1, discovery_buffer)
+        # Decoded images handed to FaceProcessor.process_decoded_batch at once
+        self.infer_batch_size = max(1, infer_batch_size)
+        # Progress is reported at most this often, however many files are handled
+        self.progress_interval = progress_interval
+        # fingerprint.FULL, or fingerprint.SAMPLED to hash only parts of very large files
+        self.hash_mode = hash_mode
+        self.fingerprinter = Fingerprinter(mode=hash_mode)
+
+        # Multi-process mode: with processes > 1, each worker process builds its own
+        # FaceProcessor(**processor_options) and `processor` is not used for inference
+        self.processes = processes
+        self.processor_options = dict(processor_options or {})
+        if self.processes > 1 and not self.processor_options.get('intra_op_threads'):
+            # Split the cores between workers instead of letting every session grab them all
+            self.processor_options['intra_op_threads'] = max(1, (os.cpu_count() or 1) // self.processes)
+
+    def _make_fingerprinter(self) -> Fingerprinter:
+        """
+        Fingerprinter for this scan. While the library has rows hashed with another
+        full-content algorithm (e.g. MD5 from older versions), that one is computed too,
+        so moved files still match them. Scans rehash those rows (see _pending_files),
+        so the extra algorithm is dropped once none are left.
+        """
+        extra = []
+        for algorithm in self.db.get_hash_algorithms():
+            if algorithm == DEFAULT_ALGORITHM or algorithm.endswith(SAMPLED_SUFFIX):
+                continue
+            try:
+                new_hasher(algorithm)
+                extra.append(algorithm)
+            except ValueError:
+                logger.warning(f"Cannot compute {algorithm} hashes; moved files hashed with it are rescanned.")
+        return Fingerprinter(DEFAULT_ALGORITHM, self.hash_mode, extra)
 
     def scan_directory(self, root_path: str, progress_callback=None, abort_check=None):
+        """
+        Scans root_path with a staged pipeline:
+
+            feeder (this thread): stat + DB skip check on (size, mtime_ns, inode)
+            -> read pool:   read file once, fingerprint the buffer   (read_workers threads)
+            -> decode pool: cv2 decode from that buffer             (decode_workers threads)
+            -> inference:   FaceAnalysis, batched    (1 thread)
+            -> writer:      batched DB inserts       (1 thread)
+
+        Files whose fingerprint matches an indexed file skip decoding and inference: the
+        writer moves that file's faces to the new path when the old path is gone
+        (a move or rename), and copies them otherwise (a duplicate). After a complete,
+        uninterrupted walk, indexed files under root_path that the scan did not find
+        and that no longer exist are removed with their faces, unless their drive or
+        share looks disconnected (see _remove_missing).
+
+        With processes > 1 the read/decode/inference stages are replaced by a pool of
+        worker processes, each with its own ONNX sessions, feeding the same writer.
+
+        progress_callback(report) receives ScanProgress reports (counts of skipped,
+        processed and failed files, faces found, throughput) at most every
+        progress_interval seconds, and always once at the end. `estimated_total` stays
+        True while discovery is still running and `total` is only the number of images
+        found so far. abort_check() is polled before each file.
+
+        Returns the final report.
+        """
         logger.info(f"Scanning directory: {root_path}")
         root = Path(root_path)
-        
+
         if not root.exists():
             logger.error(f"Path does not exist: {root_path}")
-            return
+            return None
+
+        # Phase 1: Discovery streams image paths in the background; the total grows
+        # as it goes and is only exact once the walk has finished.
+        stop = threading.Event()
+        discovery = {'found': 0, 'done': False, 'unreadable': []}
+        found_q = queue.Queue(self.discovery_buffer)
+        discoverer = threading.Thread(target=self._releasing(self._discover), args=(root_path, found_q, discovery, stop),
+                                      name="scan-discovery", daemon=True)
+        discoverer.start()
+
+        # Phase 2: Pipeline
+        progress = ScanProgress(progress_callback, discovery, self.progress_interval)
+        progress.start()
 
-        # Phase 1: Count total images (for progress bar)
-        image_files = []
-        for dirpath, _, filenames in os.walk(root):
-            for f in filenames:
-                if Path(f).suffix.lower() in VALID_EXTENSIONS:
-                    image_files.append(os.path.join(dirpath, f))
-        
-        total_files = len(image_files)
-        logger.info(f"Found {total_files} images to process.")
-        
-        processed_files = 0
-        
-        for idx, full_path in enumerate(image_files):
-             # Progress update
-            if progress_callback:
-                progress_callback(processed_files, total_files, os.path.basename(full_path))
-            
+        write_q = queue.Queue(self.queue_size)
+        writer = threading.Thread(target=self._releasing(self._writer_loop), args=(write_q, progress), name="scan-writer",
+                                  daemon=True)
+        writer.start()
+
+        # One bulk read of what is already indexed instead of a DB query per file
+        known = self.db.load_file_index()
+        logger.info(f"Loaded {len(known)} indexed files for change detection.")
+        self.fingerprinter = self._make_fingerprinter()
+        # Rows recorded with any other algorithm are rehashed when their file is found
+        outdated = self.db.get_hash_algorithms() - {DEFAULT_ALGORITHM, DEFAULT_ALGORITHM + SAMPLED_SUFFIX}
+        rehash = self.db.get_paths_by_hash_algorithms(outdated) if outdated else set()
+        if rehash:
+            logger.info(f"Rehashing {len(rehash)} files fingerprinted with {', '.join(sorted(outdated))}.")
+        # Files found by this scan are stamped with it; the rest are candidates for removal
+        self.generation = self.db.next_scan_generation()
+        pending = self._pending_files(found_q, known, rehash, progress, abort_check, stop, write_q)
+        try:
+            if self.processes > 1:
+                self._run_process_pool(pending, write_q, stop, progress)
+            else:
+                self._run_thread_pipeline(pending, write_q, stop)
+        finally:
+            stop.set()
+            discoverer.join()
+            write_q.put(_DONE)
+            writer.join()
+            if discovery['done'] and not (abort_check and abort_check()):
+                progress.removed = self._remove_missing(root_path, discovery['unreadable'])
+            report = progress.finish()
+
+        logger.info(f"Scan complete. {report['current']} of {report['total']} images: {report['processed']} "
+                    f"processed ({report['reused']} reused), {report['skipped']} unchanged, "
+                    f"{report['errors']} errors, {report['faces']} faces, {report['removed']} removed.")
+        return report
+
+    def _discover(self, root_path, found_q, discovery, stop):
+        """Discovery thread: pushes (path, stat) for every image under root_path, then _DONE."""
+        try:
+            for path, st in iter_image_files(root_path, discovery['unreadable']):
+                if not _put_unless_stopped(found_q, (path, st), stop):
+                    return
+                discovery['found'] += 1
+            discovery['done'] = True
+            logger.info(f"Discovery complete. Found {discovery['found']} images.")
+        except Exception as e:
+            logger.error(f"Discovery failed under {root_path}: {e}")
+        finally:
+            _put_unless_stopped(found_q, _DONE, stop)
+
+    def _pending_files(self, found_q, known, rehash, progress, abort_check, stop, write_q):
+        """
+        Yields work items for files that are new or modified; skipped files count as progress
+        and are sent to the writer in batches to be marked as seen by this scan. Skipped
+        files whose path is in `rehash` are yielded to be fingerprinted again, without
+        decoding or inference.
+        """
+        unchanged = []
+        while True:
+            found = found_q.get()
+            if found is _DONE:
+                if unchanged:
+                    write_q.put({'seen': unchanged})
+                return
             if abort_check and abort_check():
                 logger.info("Scan aborted by user.")
-                break
+                stop.set()
+                return
 
-            mtime = os.path.getmtime(full_path)
-            
-            # Check DB
-            if self.db.file_exists(full_path, mtime):
-                processed_files += 1
+            full_path, st = found
+            previous = known.get(full_path)
+            if previous and is_unchanged(previous, st):
+                progress.skip(os.path.basename(full_path))
+                if full_path in rehash:
+                    yield {'path': full_path, 'size': st.st_size, 'known': True, 'rehash': True}
+                    continue
+                unchanged.append(full_path)
+                if len(unchanged) >= SEEN_BATCH:
+                    write_q.put({'seen': unchanged})
+                    unchanged = []
                 continue
-            
-            # Process
-            logger.info(f"Processing: {os.path.basename(full_path)}")
-            file_hash = self.calculate_hash(full_path)
-            
-            self.db.add_file(full_path, file_hash, mtime)
-            
-            if self.processor:
+
+            yield {'path': full_path, 'mtime': st.st_mtime, 'mtime_ns': st.st_mtime_ns, 'inode': st.st_ino or None,
+                   'size': st.st_size, 'known': previous is not None}
+
+    def _run_thread_pipeline(self, pending, write_q, stop):
+        read_q = queue.Queue(self.queue_size)
+        decode_q = queue.Queue(self.buffered_queue_size)
+        infer_q = queue.Queue(self.decoded_queue_size)
+
+        stages = [
+            self._start_stage(self._read_item, read_q, decode_q, self.read_workers, stop),
+            self._start_stage(self._decode_item, decode_q, infer_q, self.decode_workers, stop),
+            self._start_stage(self._infer_items, infer_q, write_q, 1, stop, batch_size=self.infer_batch_size),
+        ]
+        try:
+            for item in pending:
+                read_q.put(item)
+        finally:
+            # Drain the stages in order so every queued item reaches the writer
+            in_q = read_q
+            for threads, out_q in stages:
+                for _ in threads:
+                    in_q.put(_DONE)
+                for t in threads:
+                    t.join()
+                in_q = out_q
+
+    def _run_process_pool(self, pending, write_q, stop, progress):
+        """Shards pending files across worker processes; results stream back to the writer queue."""
+        logger.info(f"Scanning with {self.processes} worker processes "
+                    f"({self.processor_options.get('intra_op_threads')} intra-op threads each)")
+        # Bounds the number of files in flight
+        slots = threading.BoundedSemaphore(self.queue_size)
+        ctx = multiprocessing.get_context("spawn")
+        pool = ctx.Pool(self.processes, initializer=_init_worker,
+                        initargs=(self.processor_options, self.db.db_path, self.fingerprinter))
+        try:
+            for item in pending:
+                slots.acquire()
+                if stop.is_set():
+                    break
+
+                def on_done(result):
+                    write_q.put(result)
+                    slots.release()
+
+                def on_error(e, item=item):
+                    # Not recorded, so the file is retried on the next scan
+                    logger.error(f"Error processing faces for {item['path']}: {e}")
+                    if not item.get('rehash'):
+                        progress.done(os.path.basename(item['path']), error=True)
+                    slots.release()
+
+                pool.apply_async(_process_in_worker, (item,), callback=on_done, error_callback=on_error)
+
+            if stop.is_set():
+                # Aborted: drop work still in flight
+                pool.terminate()
+            else:
+                pool.close()
+            pool.join()
+        except BaseException:
+            pool.terminate()
+            raise
+
+    def _releasing(self, fn):
+        """
+        Wraps a thread target so the thread's database connection is closed when it
+        exits; the Database is shared with the library session and outlives the scan.
+        """
+        def run(*args):
+            try:
+                fn(*args)
+            finally:
+                self.db.release_thread_connection()
+        return run
+
+    def _start_stage(self, fn, in_q, out_q, workers, stop, batch_size=None):
+        """
+        Starts worker threads that apply fn to each item of in_q and pass it on to out_q.
+        With batch_size set, fn receives a list of up to batch_size items that were ready together.
+        """
+        def loop():
+            done = False
+            while not done:
+                item = in_q.get()
+                if item is _DONE:
+                    break
+                items = [item]
+                while batch_size and len(items) < batch_size:
+                    try:
+                        item = in_q.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _DONE:
+                        done = True
+                        break
+                    items.append(item)
+
+                if stop.is_set():
+                    # Aborted: drop pending work instead of processing it
+                    continue
                 try:
-                    faces = self.processor.process_image(full_path)
-                    if faces:
-                        self.db.add_faces(full_path, faces) 
-                        logger.info(f"Found {len(faces)} faces in {os.path.basename(full_path)}")
+                    fn(items if batch_size else items[0])
                 except Exception as e:
-                    logger.error(f"Error processing faces for {full_path}: {e}")
-            
-            processed_files += 1
+                    logger.error(f"Error processing faces for {', '.join(i['path'] for i in items)}: {e}")
+                    for failed in items:
+                        failed['error'] = True
+                for item in items:
+                    out_q.put(item)
 
-        logger.info(f"Scan complete. Processed {processed_files} files.")
-        if progress_callback:
-             progress_callback(processed_files, total_files, "Complete")
+        threads = [threading.Thread(target=self._releasing(loop), name=f"scan-{fn.__name__.strip('_')}-{i}", daemon=True)
+                   for i in range(workers)]
+        for t in threads:
+            t.start()
+        return threads, out_q
 
+    def _read_item(self, item):
+        logger.info(f"Processing: {os.path.basename(item['path'])}")
+        # Duplicates of indexed files get no buffer: the writer reuses their faces
+        data = _read_and_fingerprint(item, self.fingerprinter, self.db)
+        if self.processor and data is not None:
+            item['data'] = data
+
+    def _decode_item(self, item):
+        data = item.pop('data', None)
+        if data is not None:
+            # cv2.imdecode releases the GIL, so decoding runs in parallel
+            item['image'] = self.processor.decode_image(data, item['path'])
+            if item['image'] is None:
+                item['error'] = item['undecodable'] = True
+
+    def _infer_items(self, items):
+        images = [item.pop('image', None) for item in items]
+        if self.processor and any(img is not None for img in images):
+            results = self.processor.process_decoded_batch(images, [item['path'] for item in items])
+            for item, faces in zip(items, results):
+                item['faces'] = faces
+
+    def _writer_loop(self, write_q, progress, flush_interval: float = 0.5):
+        """Commits finished items in batches; the only thread that writes to the DB during a scan."""
+        batch = []
+        deadline = None
+        done = False
+        while not done:
+            try:
+                # Block for the first item, then wait at most until the batch is due
+                timeout = None if not batch else max(0.0, deadline - time.monotonic())
+                item = write_q.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _DONE:
+                done = True
+            elif item is not None:
+                if not batch:
+                    deadline = time.monotonic() + flush_interval
+                batch.append(item)
+
+            if batch and (done or len(batch) >= self.write_batch_size or time.monotonic() >= deadline):
+                written = self._write_batch(batch)
+                for item in batch:
+                    if 'seen' in item or item.get('rehash'):
+                        # Already counted as skipped by the feeder
+                        continue
+                    progress.done(os.path.basename(item['path']), item.get('face_count', 0),
+                                  error=not written or item.get('error', False), reused=item.get('duplicate', False))
+                batch = []
+
+    def _write_batch(self, batch):
+        try:
+            # Record files and their faces in a single commit
+            with self.db.transaction():
+                for item in batch:
+                    if 'seen' in item:
+                        # Unchanged files found by the feeder
+                        self.db.mark_files_seen(item['seen'], self.generation)
+                        continue
+                    if item.get('rehash'):
+                        if not item.get('error'):
+                            algorithm, digest = next(iter(item['hashes'].items()))
+                            self.db.update_file_hash(item['path'], digest, algorithm)
+                        continue
+                    if item.get('error'):
+                        if item.get('undecodable'):
+                            # Skipped until it changes; read and inference errors are retried on the next scan
+                            if item.get('known'):
+                                # Its faces came from content that is no longer there
+                                self.db.delete_faces(item['path'])
+                            self.db.add_failed_file(item['path'], item['mtime'], item.get('size'),
+                                                    item.get('mtime_ns'), item.get('inode'))
+                        continue
+                    if item.get('duplicate'):
+                        self._reuse_faces(item)
+                        continue
+                    if item.get('known'):
+                        # Modified file: its new faces replace the old ones
+                        self.db.delete_faces(item['path'])
+                    self._record_file(item)
+                    faces = item.get('faces')
+                    item['face_count'] = len(faces or ())
+                    if faces:
+                        self.db.add_faces(item['path'], faces)
+                        logger.info(f"Found {len(faces)} faces in {os.path.basename(item['path'])}")
+                # Found by this scan, whether or not they were recorded (e.g. after an error)
+                self.db.mark_files_seen([item['path'] for item in batch if 'path' in item], self.generation)
+        except Exception as e:
+            logger.error(f"Failed to write scan batch of {len(batch)} files: {e}")
+            return False
+
+        try:
+            self.vector_store.sync(self.db)
+        except Exception as e:
+            # The store is rebuilt from the database on the next sync
+            logger.error(f"Failed to update vector store: {e}")
+        return True
+
+    def _record_file(self, item):
+        """Records a file with its change key and the fingerprint it was hashed with."""
+        algorithm, digest = next(iter(item['hashes'].items()))
+        self.db.add_file(item['path'], digest, item['mtime'], item.get('size'),
+                         item.get('mtime_ns'), item.get('inode'), algorithm)
+
+    def _reuse_faces(self, item):
+        """
+        Records a file whose fingerprint matches indexed files without running inference:
+        faces of a source path that no longer exists are moved here (move/rename),
+        otherwise they are copied from an existing one (duplicate). Runs inside the
+        writer's transaction.
+        """
+        path = item['path']
+        sources = _matching_paths(self.db, item)
+        if path in sources:
+            # Same content at the same path (e.g. only touched): nothing to redo
+            self._record_file(item)
+            item['face_count'] = 0
+            return
+        if not sources:
+            # The matching file was removed since the hash lookup; retried on the next scan
+            logger.warning(f"Indexed copy of {path} disappeared; will rescan it next time.")
+            item['error'] = True
+            return
+
+        missing = [source for source in sources if not os.path.exists(source)]
+        if missing:
+            item['face_count'] = self.db.move_file(missing[0], path)
+            logger.info(f"Moved {item['face_count']} faces from {missing[0]} to {path}")
+        else:
+            item['face_count'] = self.db.copy_faces(sources[0], path)
+            logger.info(f"Copied {item['face_count']} faces from {sources[0]} to {path}")
+        self._record_file(item)
+
+    def _remove_missing(self, root_path, unreadable) -> int:
+        """
+        Forgets indexed files under root_path that this scan did not find and that are
+        gone from disk, a page of rows at a time. Nothing is removed when root_path can
+        no longer be listed (e.g. its drive or share dropped during the scan), and files
+        are kept under folders that could not be read, when their state cannot be
+        determined, or when their whole folder looks unreachable rather than deleted.
+        """
+        if _list_dir(root_path) is None:
+            logger.warning(f"{root_path} is no longer reachable; keeping files it did not find.")
+            return 0
+        prefix = os.path.join(root_path, "")
+        skipped_dirs = tuple(os.path.join(d, "") for d in unreadable)
+        removed, after = 0, None
+        unreachable = {}
+        while True:
+            paths = self.db.get_unseen_files(prefix, self.generation, after)
+            if not paths:
+                break
+            after = paths[-1]
+            missing = [path for path in paths
+                       if not path.startswith(skipped_dirs) and _is_missing(path)
+                       and not _folder_unreachable(path, root_path, unreachable)]
+            if not missing:
+                continue
+            try:
+                removed += self.db.remove_files(missing)
+            except Exception as e:
+                logger.error(f"Failed to remove {len(missing)} missing files from the index: {e}")
+                break
+        if removed:
+            logger.info(f"Removed {removed} missing files from the index.")
+        return removed
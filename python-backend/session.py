@@ -0,0 +1,202 @@
+import os
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger("FaceFrameSession")
+
+
+def library_db_path(path: str) -> str:
+    """Path of the index database of a library folder."""
+    return os.path.join(path, ".faceframe", "index.db")
+
+
+def library_key(path: str) -> str:
+    """Normalized library path, used to identify a library across commands."""
+    return os.path.normcase(os.path.abspath(path))
+
+
+class LibrarySession:
+    """
+    Long-lived state for one library: an open Database, its VectorStore, the
+    similarity index (cached embedding matrix) and cached query results.
+
+    Cached results are dropped whenever the database changes. Changes are detected
+    with Database.data_version(), so writes made by a scan, a clustering run or
+    another process invalidate the cache just like writes made through the session.
+
+    Commands hold the session while they use it (SessionRegistry.use); close()
+    turns new users away and waits for the current ones, so a query running
+    alongside CLEAR_INDEX never sees its connection closed underneath it.
+    """
+
+    def __init__(self, path: str):
+        # Imported here so the registry can be created without loading numpy
+        from database import Database
+        from vector_store import VectorStore
+        self.path = path
+        self.db_path = library_db_path(path)
+        self.db = Database(self.db_path)
+        self.vector_store = VectorStore.for_database(self.db_path)
+        self._similarity = None
+        self._cache = {}
+        self._cache_version = None
+        self._lock = threading.Lock()
+        # Commands currently using the session; close() waits for them
+        self._users = 0
+        self._closing = False
+        self._idle = threading.Condition(self._lock)
+
+    @property
+    def similarity(self):
+        """The library's SimilarityIndex, created on first use."""
+        with self._lock:
+            if self._similarity is None:
+                from similarity import SimilarityIndex
+                self._similarity = SimilarityIndex(self.db, self.vector_store)
+            return self._similarity
+
+    def cached(self, key, load):
+        """Returns the cached result for key, calling load() if missing or stale."""
+        version = self.db.data_version()
+        with self._lock:
+            if version != self._cache_version:
+                self._cache.clear()
+                self._cache_version = version
+            if key in self._cache:
+                return self._cache[key]
+        value = load()
+        with self._lock:
+            if self._cache_version == version:
+                self._cache[key] = value
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._cache.clear()
+            self._cache_version = None
+
+    # Cached queries
+
+    def get_persons(self):
+        return self.cached(("persons",), self.db.get_persons)
+
+    def get_unclustered_faces_info(self):
+        return self.cached(("unclustered",), self.db.get_unclustered_faces_info)
+
+    def get_photos_by_person(self, person_id: int):
+        return self.cached(("photos_by_person", person_id), lambda: self.db.get_photos_by_person(person_id))
+
+    # Writes
+
+    def rename_person(self, person_id: int, new_name: str):
+        self.db.rename_person(person_id, new_name)
+        self.invalidate()
+
+    def merge_persons(self, keep_person_id: int, merge_person_id: int):
+        self.db.merge_persons(keep_person_id, merge_person_id)
+        self.invalidate()
+
+    # Lifetime
+
+    def enter(self) -> bool:
+        """Registers a user of the session. False once the session is closing."""
+        with self._lock:
+            if self._closing:
+                return False
+            self._users += 1
+            return True
+
+    def exit(self):
+        with self._lock:
+            self._users -= 1
+            if self._users == 0:
+                self._idle.notify_all()
+
+    def close(self):
+        """Refuses new users, waits for the current ones to finish, then closes."""
+        with self._lock:
+            self._closing = True
+            while self._users:
+                self._idle.wait()
+        self.invalidate()
+        self.vector_store.close()
+        self.db.close()
+
+
+class SessionRegistry:
+    """
+    Open LibrarySessions keyed by library path.
+
+    While a library is being closed (see closed()), get() and use() block until it
+    is done, so nothing reopens its index in the middle of e.g. CLEAR_INDEX.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+        # Keys of libraries being closed; waiters are woken when one is done
+        self._closing = set()
+        self._closed = threading.Condition(self._lock)
+
+    def get(self, path: str) -> LibrarySession:
+        """Returns the session for a library folder, opening it on first use."""
+        key = library_key(path)
+        with self._lock:
+            while key in self._closing:
+                self._closed.wait()
+            session = self._sessions.get(key)
+            if session is None:
+                session = LibrarySession(path)
+                self._sessions[key] = session
+                logger.info(f"Opened library session for {path}")
+            return session
+
+    @contextmanager
+    def use(self, path: str):
+        """
+        Yields the session of a library and keeps it open until the block exits.
+        A session that started closing in the meantime is replaced by a new one.
+        """
+        while True:
+            session = self.get(path)
+            if session.enter():
+                break
+        try:
+            yield session
+        finally:
+            session.exit()
+
+    @contextmanager
+    def closed(self, path: str):
+        """
+        Closes and forgets the session of a library once the commands using it have
+        finished, and keeps the library closed until the block exits (e.g. while its
+        index is deleted). Sessions requested meanwhile are opened afterwards.
+        """
+        key = library_key(path)
+        with self._lock:
+            while key in self._closing:
+                self._closed.wait()
+            self._closing.add(key)
+            session = self._sessions.pop(key, None)
+        try:
+            if session is not None:
+                session.close()
+            yield
+        finally:
+            with self._lock:
+                self._closing.discard(key)
+                self._closed.notify_all()
+
+    def close(self, path: str):
+        """Closes and forgets the session of a library, once the commands using it have finished."""
+        with self.closed(path):
+            pass
+
+    def close_all(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
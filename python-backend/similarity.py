@@ -0,0 +1,171 @@
+import json
+import logging
+import threading
+import numpy as np
+from embeddings import normalize_rows
+from ivf import FLAT_INDEX_LIMIT, build_ivf_index
+from vector_store import VectorStore
+
+try:
+    import faiss
+except ImportError:
+    logging.warning("faiss not installed; similarity search uses exact matrix products only")
+    faiss = None
+
+logger = logging.getLogger("FaceFrameSimilarity")
+
+DEFAULT_K = 20
+
+
+class SimilarityIndex:
+    """
+    Top-k cosine similarity search over all faces of one library.
+
+    The index is built from the memory-mapped VectorStore and cached. Every query
+    first syncs the store with the database, so faces added by a scan since the
+    last query are picked up automatically: new vectors are appended to the
+    cached matrix / IVF index, and a store that was rebuilt or cleared causes a
+    full rebuild.
+    """
+
+    def __init__(self, db, vector_store: VectorStore = None):
+        self.db = db
+        self.vector_store = vector_store or VectorStore.for_database(db.db_path)
+        self._lock = threading.Lock()
+        self._ids = np.empty(0, dtype=np.int64)
+        self._matrix = None  # contiguous (n, dim) float32, exact mode
+        self._ann = None     # faiss IVF index, ANN mode
+
+    def __len__(self):
+        return len(self._ids)
+
+    def refresh(self):
+        """Brings the cached index up to date with the vector store."""
+        self.vector_store.sync(self.db)
+        # One snapshot: a scan may append to the store between two separate reads
+        ids, vectors = self.vector_store.snapshot()
+        n, cached = len(ids), len(self._ids)
+        if n == cached and (n == 0 or ids[-1] == self._ids[-1]):
+            return
+
+        if n < cached or (cached and ids[cached - 1] != self._ids[-1]):
+            # Store was rebuilt (e.g. index cleared); start over
+            self._ids = np.empty(0, dtype=np.int64)
+            self._matrix = self._ann = None
+            cached = 0
+
+        new_vectors = np.ascontiguousarray(vectors[cached:])
+        # Above FLAT_INDEX_LIMIT faces an IVF index is used (when faiss is installed);
+        # below it an exact search over an in-memory matrix is fast enough
+        if self._ann is None and faiss is not None and n > FLAT_INDEX_LIMIT:
+            self._build_ann(np.ascontiguousarray(vectors))
+            self._matrix = None
+        elif self._ann is not None:
+            self._ann.add(new_vectors)
+        elif self._matrix is None or cached == 0:
+            self._matrix = new_vectors
+        else:
+            self._matrix = np.concatenate([self._matrix, new_vectors])
+        self._ids = np.array(ids)
+        logger.info(f"Similarity index: {n} faces ({'IVF' if self._ann is not None else 'exact'}).")
+
+    def _build_ann(self, X):
+        index = build_ivf_index(X)
+        index.add(X)
+        self._ann = index
+        logger.info(f"Built IVF similarity index for {len(X)} faces.")
+
+    def search(self, query, k: int = DEFAULT_K, exclude_ids=()):
+        """
+        Returns (face_ids, scores) of the k faces most similar to the query vector,
+        best first, skipping exclude_ids.
+        """
+        with self._lock:
+            self.refresh()
+            if len(self._ids) == 0 or k <= 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+            q = normalize_rows(np.asarray(query, dtype=np.float32).reshape(1, -1))
+            exclude = np.asarray(exclude_ids, dtype=np.int64)
+            fetch = min(k + len(exclude), len(self._ids))
+            if self._ann is not None:
+                scores, pos = self._ann.search(q, fetch)
+                scores, pos = scores[0], pos[0]
+                valid = pos >= 0
+                scores, pos = scores[valid], pos[valid]
+            else:
+                sims = self._matrix @ q[0]
+                pos = np.argpartition(-sims, fetch - 1)[:fetch] if fetch < len(sims) else np.arange(len(sims))
+                pos = pos[np.argsort(-sims[pos])]
+                scores = sims[pos]
+            face_ids = self._ids[pos]
+
+        keep = ~np.isin(face_ids, exclude)
+        return face_ids[keep][:k], scores[keep][:k]
+
+    def vector_for_face(self, face_id: int):
+        # The append-only store still holds faces deleted since it was last rebuilt
+        if not self.db.get_faces_by_ids([face_id]):
+            raise ValueError(f"Face {face_id} not found")
+        with self._lock:
+            self.refresh()
+            X, found = self.vector_store.lookup([face_id])
+        if not found[0]:
+            raise ValueError(f"Face {face_id} not found")
+        return X[0]
+
+    def vector_for_person(self, person_id: int):
+        """The person's stored centroid, or the mean of their faces if none is stored yet."""
+        centroid = self.db.get_person_centroid(person_id)
+        if centroid is not None:
+            return centroid
+        face_ids = self.db.get_face_ids_by_person(person_id)
+        with self._lock:
+            self.refresh()
+            X, found = self.vector_store.lookup(face_ids)
+        if not found.any():
+            raise ValueError(f"Person {person_id} has no faces")
+        return X.mean(axis=0)
+
+    def find_similar(self, face_id: int = None, person_id: int = None, k: int = DEFAULT_K,
+                     include_same_person: bool = False):
+        """
+        Top-k faces similar to a face or to a person's centroid, as a list of dicts
+        (id, score, file_path, bbox, thumbnail, person_id). The query face itself is
+        never returned; for person queries that person's own faces are skipped
+        unless include_same_person is set.
+        """
+        if face_id is not None:
+            query = self.vector_for_face(face_id)
+            exclude = [face_id]
+        elif person_id is not None:
+            query = self.vector_for_person(person_id)
+            exclude = [] if include_same_person else self.db.get_face_ids_by_person(person_id)
+        else:
+            raise ValueError("FIND_SIMILAR needs a face_id or person_id")
+
+        if k <= 0:
+            return []
+        fetch = k
+        while True:
+            face_ids, scores = self.search(query, fetch, exclude)
+            info = self.db.get_faces_by_ids(face_ids)
+            # Faces deleted since their vectors were stored are dropped
+            live = [(fid, score) for fid, score in zip(face_ids.tolist(), scores.tolist()) if fid in info]
+            if len(live) >= k or len(face_ids) < fetch:
+                break
+            # Search deeper until k live faces are found or the index is exhausted
+            fetch *= 2
+
+        results = []
+        for fid, score in live[:k]:
+            file_path, bbox, thumbnail, pid = info[fid]
+            results.append({
+                "id": fid,
+                "score": round(score, 4),
+                "file_path": file_path,
+                "bbox": json.loads(bbox) if bbox else [0, 0, 0, 0],
+                "thumbnail": thumbnail,
+                "person_id": pid,
+            })
+        return results
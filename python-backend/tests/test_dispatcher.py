@@ -0,0 +1,123 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dispatcher as dispatcher_module
+from dispatcher import Dispatcher, EDIT, QUERY, WRITE
+
+
+class Replies:
+    """Collects emitted messages; wait() blocks until one matches."""
+
+    def __init__(self):
+        self.messages = []
+        self._changed = threading.Condition()
+
+    def emit(self, message):
+        with self._changed:
+            self.messages.append(message)
+            self._changed.notify_all()
+
+    def wait(self, predicate, timeout=10):
+        with self._changed:
+            if not self._changed.wait_for(lambda: any(predicate(m) for m in self.messages), timeout):
+                raise AssertionError(f"No matching message in {self.messages}")
+            return next(m for m in self.messages if predicate(m))
+
+
+class DispatcherOrderingTest(unittest.TestCase):
+    def setUp(self):
+        self.replies = Replies()
+        patcher = mock.patch.object(dispatcher_module, "emit", self.replies.emit)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.dispatcher = Dispatcher()
+        self.addCleanup(self.dispatcher.shutdown)
+
+    def test_query_waits_for_earlier_edit(self):
+        state = {"name": "old"}
+
+        def rename(cmd, reply):
+            time.sleep(0.2)
+            state["name"] = cmd["name"]
+            reply({"status": "renamed"})
+
+        self.dispatcher.register("RENAME", rename, EDIT)
+        self.dispatcher.register("READ", lambda cmd, reply: reply({"status": "read", "name": state["name"]}), QUERY)
+        self.dispatcher.dispatch({"action": "RENAME", "path": "/lib", "name": "new"})
+        self.dispatcher.dispatch({"action": "READ", "path": "/lib"})
+
+        self.assertEqual(self.replies.wait(lambda m: m["status"] == "read")["name"], "new")
+
+    def test_query_overlaps_long_write(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        self.dispatcher.register("SCAN", lambda cmd, reply: release.wait(10), WRITE)
+        self.dispatcher.register("READ", lambda cmd, reply: reply({"status": "read"}), QUERY)
+        self.dispatcher.dispatch({"action": "SCAN", "path": "/lib"})
+        self.dispatcher.dispatch({"action": "READ", "path": "/lib"})
+
+        self.replies.wait(lambda m: m["status"] == "read")
+        self.assertFalse(release.is_set())
+
+    def test_queries_of_other_libraries_do_not_wait(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        self.dispatcher.register("EDIT", lambda cmd, reply: release.wait(10), EDIT)
+        self.dispatcher.register("READ", lambda cmd, reply: reply({"status": "read"}), QUERY)
+        self.dispatcher.dispatch({"action": "EDIT", "path": "/a"})
+        self.dispatcher.dispatch({"action": "READ", "path": "/b"})
+
+        self.replies.wait(lambda m: m["status"] == "read")
+
+
+class PersonEditsTest(unittest.TestCase):
+    """RENAME_PERSON / MERGE_PERSONS followed by GET_PERSONS, through the real handlers."""
+
+    def setUp(self):
+        import main
+        self.main = main
+        self.replies = Replies()
+        patcher = mock.patch.object(dispatcher_module, "emit", self.replies.emit)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path, True)
+        os.makedirs(os.path.join(self.path, ".faceframe"))
+        self.addCleanup(main.sessions.close, self.path)
+        db = main.sessions.get(self.path).db
+        self.keep_id = db.create_person("Alice")
+        self.merge_id = db.create_person("Bob")
+
+        self.dispatcher = main.build_dispatcher()
+        self.addCleanup(self.dispatcher.shutdown)
+
+    def get_persons(self, request_id):
+        self.dispatcher.dispatch({"action": "GET_PERSONS", "path": self.path, "request_id": request_id})
+        reply = self.replies.wait(lambda m: m.get("request_id") == request_id)
+        self.assertEqual(reply["status"], "persons")
+        return {p["id"]: p["name"] for p in reply["data"]}
+
+    def test_rename_then_read(self):
+        for i in range(5):
+            name = f"Carol {i}"
+            self.dispatcher.dispatch({"action": "RENAME_PERSON", "path": self.path,
+                                      "person_id": self.keep_id, "new_name": name})
+            self.assertEqual(self.get_persons(f"read-{i}")[self.keep_id], name)
+
+    def test_merge_then_read(self):
+        self.dispatcher.dispatch({"action": "MERGE_PERSONS", "path": self.path,
+                                  "keep_id": self.keep_id, "merge_id": self.merge_id})
+        self.assertNotIn(self.merge_id, self.get_persons("read"))
+
+
+if __name__ == "__main__":
+    unittest.main()
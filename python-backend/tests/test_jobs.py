@@ -0,0 +1,71 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dispatcher as dispatcher_module
+from dispatcher import WRITE
+from test_dispatcher import Replies
+
+
+class QueuedJobsTest(unittest.TestCase):
+    """Job commands waiting behind another write of the same library."""
+
+    def setUp(self):
+        import main
+        self.main = main
+        self.replies = Replies()
+        patcher = mock.patch.object(dispatcher_module, "emit", self.replies.emit)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path, True)
+        os.makedirs(os.path.join(self.path, ".faceframe"))
+        self.addCleanup(main.sessions.close, self.path)
+
+        self.dispatcher = main.build_dispatcher()
+        self.addCleanup(self.dispatcher.shutdown)
+        # Holds the library's write queue until released
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.dispatcher.register("BLOCK", lambda cmd, reply: self.release.wait(10), WRITE)
+        self.dispatcher.dispatch({"action": "BLOCK", "path": self.path})
+
+    def queue_rebuild(self, request_id):
+        self.dispatcher.dispatch({"action": "REBUILD_INDEX", "path": self.path, "request_id": request_id})
+        queued = self.replies.wait(lambda m: m.get("request_id") == request_id)
+        self.assertEqual(queued["status"], "queued")
+        return queued["job_id"]
+
+    def test_queued_job_is_listed(self):
+        job_id = self.queue_rebuild("rebuild")
+        jobs = {job["job_id"]: job for job in self.main.jobs.list()}
+        self.assertEqual(jobs[job_id]["state"], "queued")
+
+        self.release.set()
+        done = self.replies.wait(lambda m: m.get("request_id") == "rebuild" and m["status"] == "index_rebuilt")
+        self.assertEqual(done["job_id"], job_id)
+        self.assertEqual(self.main.jobs.get(job_id).state, "completed")
+
+    def test_job_cancelled_while_queued_never_runs(self):
+        job_id = self.queue_rebuild("rebuild")
+        self.dispatcher.dispatch({"action": "CANCEL_JOB", "job_id": job_id, "request_id": "cancel"})
+        self.assertEqual(self.replies.wait(lambda m: m.get("request_id") == "cancel")["job_ids"], [job_id])
+
+        self.release.set()
+        done = self.replies.wait(lambda m: m.get("request_id") == "rebuild" and m["status"] == "cancelled")
+        self.assertEqual(done["job_id"], job_id)
+        self.assertFalse(any(m.get("request_id") == "rebuild" and m["status"] == "progress"
+                             for m in self.replies.messages))
+        self.assertEqual(self.main.jobs.get(job_id).state, "cancelled")
+
+
+if __name__ == "__main__":
+    unittest.main()
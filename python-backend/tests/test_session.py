@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dispatcher as dispatcher_module
+from dispatcher import QUERY
+from test_dispatcher import Replies
+
+
+class ClearIndexTest(unittest.TestCase):
+    """CLEAR_INDEX while queries are using, or about to use, the same library."""
+
+    def setUp(self):
+        import main
+        self.main = main
+        self.replies = Replies()
+        patcher = mock.patch.object(dispatcher_module, "emit", self.replies.emit)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path, True)
+        self.folder = os.path.join(self.path, ".faceframe")
+        os.makedirs(self.folder)
+        self.addCleanup(main.sessions.close, self.path)
+        main.sessions.get(self.path).db.create_person("Alice")
+
+        self.dispatcher = main.build_dispatcher()
+        self.addCleanup(self.dispatcher.shutdown)
+
+    def test_clear_waits_for_running_query(self):
+        started = threading.Event()
+
+        def slow_read(cmd, reply):
+            with self.main.sessions.use(self.path) as session:
+                started.set()
+                time.sleep(0.3)
+                reply({"status": "read", "count": len(session.db.get_persons())})
+
+        self.dispatcher.register("SLOW_READ", slow_read, QUERY)
+        self.dispatcher.dispatch({"action": "SLOW_READ", "path": self.path, "request_id": "read"})
+        started.wait(5)
+        self.dispatcher.dispatch({"action": "CLEAR_INDEX", "path": self.path, "request_id": "clear"})
+
+        self.assertEqual(self.replies.wait(lambda m: m.get("request_id") == "read"),
+                         {"status": "read", "count": 1, "request_id": "read"})
+        self.replies.wait(lambda m: m.get("request_id") == "clear" and m["status"] == "index_cleared")
+        self.assertFalse(os.path.exists(self.folder))
+
+    def test_query_during_clear_does_not_reopen_the_index(self):
+        started = threading.Event()
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def hold():
+            with self.main.sessions.use(self.path):
+                started.set()
+                release.wait(5)
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        started.wait(5)
+        self.dispatcher.dispatch({"action": "CLEAR_INDEX", "path": self.path, "request_id": "clear"})
+        time.sleep(0.1)  # CLEAR_INDEX is now waiting for the holder
+
+        # A query that was dispatched before the clear and only now gets to the library
+        late = {}
+
+        def late_query():
+            try:
+                with self.main.sessions.use(self.path) as session:
+                    late["persons"] = session.db.get_persons()
+            except sqlite3.Error as e:
+                late["error"] = e
+
+        query = threading.Thread(target=late_query)
+        query.start()
+        time.sleep(0.1)
+        self.assertNotIn("persons", late)  # Blocked while the library is closing
+
+        release.set()
+        holder.join(5)
+        query.join(5)
+        self.replies.wait(lambda m: m.get("request_id") == "clear" and m["status"] == "index_cleared")
+        # The index was gone by the time the query could open the library
+        self.assertIn("error", late)
+        self.assertFalse(os.path.exists(self.folder))
+
+
+if __name__ == "__main__":
+    unittest.main()
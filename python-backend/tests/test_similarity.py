@@ -0,0 +1,58 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+from similarity import SimilarityIndex
+
+
+class DeletedFacesTest(unittest.TestCase):
+    """Faces deleted from the database stay in the append-only vector store."""
+
+    def setUp(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder, True)
+        self.db = Database(os.path.join(folder, "index.db"))
+        self.addCleanup(self.db.close)
+
+        rng = np.random.default_rng(0)
+        base = rng.standard_normal(512).astype(np.float32)
+        # Ten files of near-identical faces: the first ones are the closest matches
+        for i in range(10):
+            path = f"/photos/{i}.jpg"
+            self.db.add_file(path, f"hash{i}", 0.0)
+            embedding = base + (i + 1) * 0.01 * rng.standard_normal(512).astype(np.float32)
+            self.db.add_faces(path, [{"embedding": embedding, "bbox": [0, 0, 1, 1]}])
+        self.ids = {path: face_id for face_id, path in self.faces()}
+        self.index = SimilarityIndex(self.db)
+        self.index.refresh()
+
+    def faces(self):
+        return self.db.get_connection().execute("SELECT id, file_path FROM faces ORDER BY id").fetchall()
+
+    def test_deleted_face_is_not_found(self):
+        self.db.remove_files(["/photos/3.jpg"])
+        with self.assertRaisesRegex(ValueError, "not found"):
+            self.index.find_similar(face_id=self.ids["/photos/3.jpg"])
+
+    def test_returns_k_live_faces(self):
+        deleted = [f"/photos/{i}.jpg" for i in range(1, 5)]
+        self.db.remove_files(deleted)
+        results = self.index.find_similar(face_id=self.ids["/photos/0.jpg"], k=4)
+        self.assertEqual(len(results), 4)
+        self.assertFalse({r["file_path"] for r in results} & set(deleted))
+
+    def test_fewer_live_faces_than_k(self):
+        self.db.remove_files([f"/photos/{i}.jpg" for i in range(1, 9)])
+        results = self.index.find_similar(face_id=self.ids["/photos/0.jpg"], k=5)
+        self.assertEqual([r["file_path"] for r in results], ["/photos/9.jpg"])
+
+
+if __name__ == "__main__":
+    unittest.main()
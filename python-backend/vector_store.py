@@ -0,0 +1,220 @@
+import os
+import struct
+import logging
+import threading
+import numpy as np
+from embeddings import normalize_rows
+
+logger = logging.getLogger("FaceFrameVectorStore")
+
+# File stored next to index.db and thumbnails/ in .faceframe/
+VECTOR_FILE_NAME = "embeddings.vec"
+
+# Layout:
+#   16-byte header: magic b"FFVS", format version (u16), reserved (u16), dim (u32), reserved (u32)
+#   fixed-size records ordered by face id: (id int64, vector float32[dim]), L2-normalized
+MAGIC = b"FFVS"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHHI4x")
+
+# Faces read from the database per sync step
+SYNC_BATCH = 20000
+
+
+# One lock per file, shared by every VectorStore instance in the process
+# (the scanner, clusterer and search cache each hold their own instance)
+_file_locks = {}
+_file_locks_guard = threading.Lock()
+
+def _lock_for(path: str) -> threading.Lock:
+    with _file_locks_guard:
+        return _file_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+def vector_store_path(db_path: str) -> str:
+    """Path of the vector file belonging to an index.db."""
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), VECTOR_FILE_NAME)
+
+
+class VectorStore:
+    """
+    Append-only on-disk copy of all face embeddings, keyed by face id and
+    memory-mapped on read, so clustering and similarity search do not need to
+    re-read and decode the faces table. The database stays the source of truth:
+    sync() appends whatever faces were added since the last sync.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = _lock_for(path)
+        self._records = None  # memmap, opened lazily
+        self._mapped_size = 0
+        self._dim = None
+
+    @classmethod
+    def for_database(cls, db_path: str):
+        return cls(vector_store_path(db_path))
+
+    def _record_dtype(self, dim: int):
+        return np.dtype([('id', '<i8'), ('vec', '<f4', (dim,))])
+
+    def _read_header(self):
+        with open(self.path, "rb") as f:
+            raw = f.read(HEADER.size)
+        if len(raw) < HEADER.size:
+            raise ValueError("truncated header")
+        magic, version, _, dim = HEADER.unpack(raw)
+        if magic != MAGIC or version != FORMAT_VERSION or dim == 0:
+            raise ValueError(f"unrecognized header {magic!r} v{version} dim={dim}")
+        return dim
+
+    def _open(self):
+        """
+        Memory-maps the record area (None if the file is missing or empty).
+        The map is refreshed when the file has grown, e.g. after another instance appended.
+        """
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            self._records = None
+            self._mapped_size = 0
+            return None
+        if self._records is not None and size == self._mapped_size:
+            return self._records
+
+        dim = self._read_header()
+        dtype = self._record_dtype(dim)
+        count = (size - HEADER.size) // dtype.itemsize
+        self._dim = dim
+        self._records = None
+        if count > 0:
+            self._records = np.memmap(self.path, dtype=dtype, mode="r", offset=HEADER.size, shape=(count,))
+        self._mapped_size = size
+        return self._records
+
+    def close(self):
+        """Drops the memory map (required before deleting the file on Windows)."""
+        with self._lock:
+            self._records = None
+            self._mapped_size = 0
+
+    def __len__(self):
+        records = self._open()
+        return 0 if records is None else len(records)
+
+    @property
+    def ids(self) -> np.ndarray:
+        records = self._open()
+        return np.empty(0, dtype=np.int64) if records is None else records['id']
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """All stored vectors as an (n, dim) read-only memory-mapped view."""
+        records = self._open()
+        return np.empty((0, self._dim or 0), dtype=np.float32) if records is None else records['vec']
+
+    def snapshot(self):
+        """
+        Returns (ids, vectors) from a single mapping taken under the store lock, so the
+        two always line up even while another instance appends (ids and vectors read
+        separately may come from maps of different lengths).
+        """
+        with self._lock:
+            records = self._open()
+        if records is None:
+            return np.empty(0, dtype=np.int64), np.empty((0, self._dim or 0), dtype=np.float32)
+        return records['id'], records['vec']
+
+    def last_id(self) -> int:
+        ids = self.ids
+        return int(ids[-1]) if len(ids) else 0
+
+    def lookup(self, face_ids):
+        """
+        Returns (vectors, found) for the given face ids: a contiguous float32 matrix for
+        the ids present in the store (in the given order) and a boolean mask of which were.
+        """
+        face_ids = np.asarray(face_ids, dtype=np.int64)
+        ids, vectors = self.snapshot()
+        if len(ids) == 0:
+            return np.empty((0, vectors.shape[1]), dtype=np.float32), np.zeros(len(face_ids), dtype=bool)
+
+        pos = np.minimum(np.searchsorted(ids, face_ids), len(ids) - 1)
+        found = ids[pos] == face_ids
+        return np.ascontiguousarray(vectors[pos[found]]), found
+
+    def append(self, face_ids, embeddings):
+        """
+        Appends embeddings (normalized here) for increasing face ids. Ids not beyond the
+        last stored id are skipped, since another instance may have appended them already.
+        """
+        face_ids = np.asarray(face_ids, dtype=np.int64)
+        if np.any(np.diff(face_ids) <= 0):
+            raise ValueError("VectorStore.append requires increasing face ids")
+        X = normalize_rows(np.asarray(embeddings, dtype=np.float32))
+
+        with self._lock:
+            new = face_ids > self.last_id()
+            face_ids, X = face_ids[new], X[new]
+            if len(face_ids) == 0:
+                return
+            if self._dim is not None and X.shape[1] != self._dim:
+                raise ValueError(f"Embedding dimension {X.shape[1]} does not match store dimension {self._dim}")
+
+            records = np.empty(len(face_ids), dtype=self._record_dtype(X.shape[1]))
+            records['id'] = face_ids
+            records['vec'] = X
+
+            new_file = not os.path.exists(self.path)
+            with open(self.path, "ab") as f:
+                if new_file:
+                    f.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, X.shape[1]))
+                else:
+                    # Drop a partial record left by an interrupted append
+                    end = HEADER.size + len(self) * records.dtype.itemsize
+                    if f.tell() != end:
+                        f.truncate(end)
+                f.write(records.tobytes())
+            self._dim = X.shape[1]
+
+    def sync(self, db, progress_callback=None, abort_check=None) -> int:
+        """
+        Appends every face added to the database since the last sync. Returns how many.
+        progress_callback(added) is called after each batch; abort_check() stops between
+        batches (the store stays consistent and the next sync continues from there).
+        """
+        try:
+            self._open()
+        except ValueError as e:
+            logger.warning(f"Vector store {self.path} is unreadable ({e}); rebuilding.")
+            self.reset()
+
+        if self.last_id() > db.get_face_id_sequence():
+            # Holds ids the database never issued: the store belongs to an older
+            # incarnation of the database (deleting the newest faces is not enough)
+            logger.warning(f"Vector store {self.path} is ahead of the database; rebuilding.")
+            self.reset()
+
+        added = 0
+        while True:
+            face_ids, X = db.get_embeddings_after(self.last_id(), SYNC_BATCH)
+            if len(face_ids) == 0:
+                break
+            self.append(face_ids, X)
+            added += len(face_ids)
+            if progress_callback is not None:
+                progress_callback(added)
+            if abort_check is not None and abort_check():
+                break
+        if added:
+            logger.info(f"Vector store: appended {added} embeddings ({len(self)} total).")
+        return added
+
+    def reset(self):
+        """Deletes the file; the next sync() rebuilds it from the database."""
+        with self._lock:
+            self._records = None
+            self._mapped_size = 0
+            self._dim = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
@@ -41,7 +41,7 @@ function App() {
   const [providers, setProviders] = useState<string[]>([]);
   const [providerLabels, setProviderLabels] = useState<Record<string, string>>({});
   const [selectedProvider, setSelectedProvider] = useState<string>("CPUExecutionProvider");
-  const [progress, setProgress] = useState<{ current: number, total: number, file: string } | null>(null);
+  const [progress, setProgress] = useState<{ current: number, total: number, estimated: boolean, file: string } | null>(null);
 
   const [persons, setPersons] = useState<any[]>([]);
   const [unclustered, setUnclustered] = useState<any[]>([]);
@@ -78,14 +78,17 @@ function App() {
           if (cuda) setSelectedProvider(cuda);
           else if (filteredProviders.length > 0) setSelectedProvider(filteredProviders[0]);
         }
-        if (data.status === 'progress') {
+        // Clustering and index rebuild jobs report progress too; only scans drive the progress bar
+        if (data.status === 'progress' && (data.job_type ?? 'scan') === 'scan') {
           setProgress({
             current: data.current || 0,
             total: data.total || 0,
+            estimated: !!data.estimated_total,
             file: data.file || 'Unknown'
           });
         }
-        if (data.status === 'complete' || data.status === 'error' || data.status === 'cancelled') {
+        if (data.status === 'complete' || data.status === 'error' ||
+            (data.status === 'cancelled' && (data.job_type ?? 'scan') === 'scan')) {
           setState(s => ({ ...s, status: "ready" }));
           setProgress(null);
           if (state.folderPath) fetchDisplayData(state.folderPath);
@@ -199,7 +202,7 @@ function App() {
           <div style={{ flex: 1 }}>
             <div style={{ marginBottom: '5px', display: 'flex', justifyContent: 'space-between', fontSize: '14px' }}>
               <span style={{ whiteSpace: 'nowrap', overflow: 'hidden', textOverflow: 'ellipsis', maxWidth: '400px' }}>Scanning: {progress.file}</span>
-              <span style={{ fontFamily: 'monospace' }}>{progress.current} / {progress.total}</span>
+              <span style={{ fontFamily: 'monospace' }}>{progress.current} / {progress.estimated ? '~' : ''}{progress.total}</span>
             </div>
             <div style={{ width: '100%', height: '8px', background: '#444', borderRadius: '4px', overflow: 'hidden' }}>
               <div style={{
@@ -3,8 +3,11 @@ import { useState, useRef, useEffect } from 'react';
 interface Person {
     id: number;
     name: string;
-    count: number;
     thumbnail?: string;
+    face_count: number;
+    photo_count: number;
+    first_seen?: number | null;
+    last_seen?: number | null;
 }
 
 interface PeopleListProps {
@@ -174,7 +177,7 @@ export default function PeopleList({ persons, folderPath, onPersonClick, onRefre
                             ) : (
                                 <>
                                     <div style={{ fontWeight: 'bold', overflow: 'hidden', textOverflow: 'ellipsis' }}>{p.name}</div>
-                                    <div style={{ fontSize: '12px', color: '#888', marginBottom: '8px' }}>{p.count || 0} photos</div>
+                                    <div style={{ fontSize: '12px', color: '#888', marginBottom: '8px' }}>{p.photo_count || 0} photos</div>
                                     <div style={{ display: 'flex', gap: '5px', justifyContent: 'center' }} onClick={(e) => e.stopPropagation()}>
                                         <button
                                             onClick={(e) => { e.stopPropagation(); startEdit(p); }}